@@ -0,0 +1,367 @@
+import argparse
+import io
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from typing import Any, Dict, List
+
+import lib.definitions as d
+import lib.utils as u
+
+from config import Params, load_config
+
+# Rates of a statement, keyed by its real path so statements shared by several accounts are parsed once
+StatementRates = Dict[str, List[d.InterestSummary]]
+
+def find_params(paths: List[str]) -> List[str]:
+    """
+    Expands the given params files and folders (every *.json inside) into a sorted list of params files.
+    """
+    found: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.endswith(".json")
+            )
+        else:
+            found.append(path)
+    return found
+
+def output_folders(params_paths: List[str], output_root: str) -> List[str]:
+    """
+    Picks an output folder per params file, named after the file and made unique.
+    """
+    folders: List[str] = []
+    taken: set[str] = set()
+    for path in params_paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        unique = name
+        n = 2
+        while unique in taken:
+            unique = f"{name}-{n}"
+            n += 1
+        taken.add(unique)
+        folders.append(os.path.join(output_root, unique))
+    return folders
+
+def uses_shared_rates(config: Params) -> bool:
+    """
+    Whether an account takes its rates from the batch's shared extraction. An account with
+    a STORE_PATH keeps its rates in its own store, so it extracts them in its own run
+    (main.load_rates) the way main.py run does.
+    """
+    return not config.get("STORE_PATH")
+
+def list_statements(config: Params, listings: Dict[str, List[d.StatementSummary]]) -> List[d.StatementSummary]:
+    """
+    Returns every statement of an account (rates.parse_statements). Folder listings are kept
+    in listings by real path, so a folder shared by several accounts is listed once.
+    """
+    import lib.rates as r
+
+    folder = os.path.realpath(config["STATEMENT_FOLDER"])
+    if folder not in listings:
+        listings[folder] = r.parse_statements(folder)
+    return listings[folder]
+
+def select_statements(config: Params, listings: Dict[str, List[d.StatementSummary]]) -> List[d.StatementSummary]:
+    """
+    Picks the statements an account is expected to need, see rates.statements_in_range.
+    rates_for adds older ones if their file names turn out to be off.
+    """
+    import lib.accounts as a
+    import lib.rates as r
+
+    return r.statements_in_range(list_statements(config, listings), *a.rate_window(config["LOANS"]))
+
+def extract_shared_rates(
+    selected: List[List[d.StatementSummary]],
+    statement_rates: StatementRates,
+    errors: Dict[str, str],
+    use_cache: bool = True,
+    workers: int = 1
+) -> None:
+    """
+    Extracts the rates of every statement in selected that is not in statement_rates yet,
+    adding them there. Statements shared between accounts are only parsed once. A statement
+    that fails does not stop the others, its error is added to errors (both keyed by real
+    path) and it only fails the accounts that need it (fetch_rates).
+    """
+    import lib.rates as r
+
+    statements: Dict[str, d.StatementSummary] = {}
+    for account_statements in selected:
+        for statement in account_statements:
+            path = os.path.realpath(statement.path)
+            if path not in statement_rates:
+                statements.setdefault(path, statement)
+    if not statements:
+        return
+
+    unique = sorted(statements.values(), key=lambda s: s.date)
+    failed: Dict[str, str] = {}
+    per_statement = r.get_statement_rates(unique, use_cache=use_cache, workers=workers, errors=failed)
+    statement_rates.update({os.path.realpath(s.path): rates for s, rates in zip(unique, per_statement)})
+    errors.update({os.path.realpath(path): error for path, error in failed.items()})
+
+def fetch_rates(
+    statements: List[d.StatementSummary],
+    statement_rates: StatementRates,
+    errors: Dict[str, str],
+    use_cache: bool = True,
+    workers: int = 1
+) -> List[d.InterestSummary]:
+    """
+    Returns the rates of the given statements in statement order, extracting the ones not
+    in statement_rates yet (extract_shared_rates).
+
+    Raises:
+        ValueError if one of them could not be extracted
+    """
+    extract_shared_rates([statements], statement_rates, errors, use_cache, workers)
+
+    failed = [
+        f"{os.path.basename(statement.path)}: {errors[os.path.realpath(statement.path)]}"
+        for statement in statements if os.path.realpath(statement.path) in errors
+    ]
+    if failed:
+        raise ValueError("Failed to extract rates from " + "; ".join(failed))
+
+    raw_rates: List[d.InterestSummary] = []
+    for statement in statements:
+        raw_rates.extend(statement_rates[os.path.realpath(statement.path)])
+    return raw_rates
+
+def rates_for(
+    config: Params,
+    listings: Dict[str, List[d.StatementSummary]],
+    statement_rates: StatementRates,
+    errors: Dict[str, str],
+    use_cache: bool = True,
+    workers: int = 1
+) -> tuple[List[d.InterestSummary], List[d.InterestSummary]]:
+    """
+    Returns the raw and collapsed rates of one account from the shared extraction, picking
+    its statements the same way main.py run does (rates.select_rates_in_range), so older
+    statements are extracted too when their file names are off.
+
+    Raises:
+        ValueError if one of its statements could not be extracted or the rates leave a gap
+    """
+    import lib.accounts as a
+    import lib.rates as r
+
+    start, end = a.rate_window(config["LOANS"])
+    _, raw_rates = r.select_rates_in_range(
+        list_statements(config, listings), start, end,
+        lambda picked: fetch_rates(picked, statement_rates, errors, use_cache and config.get("RATE_CACHE", True), workers)
+    )
+    r.check_coverage(raw_rates, start, end)
+    return raw_rates, r.collapse_rates(raw_rates)
+
+def check_rates(config: Params, loaded_rates: tuple[List[d.InterestSummary], List[d.InterestSummary]]) -> None:
+    """
+    Checks that the rates the batch found for an account are the ones main.py run extracts
+    from the same params (main.load_rates).
+
+    Raises:
+        ValueError naming the first rate that differs
+    """
+    import main
+
+    with redirect_stdout(io.StringIO()):
+        expected = main.load_rates(config)[0]
+    raw_rates = loaded_rates[0]
+    for idx, (got, want) in enumerate(zip(raw_rates, expected)):
+        if got != want:
+            raise ValueError(f"Batch rate {idx} is {got}, main.py run has {want}")
+    if len(raw_rates) != len(expected):
+        raise ValueError(f"Batch found {len(raw_rates)} rates, main.py run {len(expected)}")
+
+def failed_result(params_path: str, output_folder: str, error: Exception) -> Dict[str, Any]:
+    """
+    Returns the result of an account that failed before its run, writing the error to its log.txt.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    with open(os.path.join(output_folder, "log.txt"), "w", encoding="utf-8") as log:
+        traceback.print_exception(error, file=log)
+    return {
+        "params": params_path, "output": output_folder, "ok": False,
+        "error": f"{type(error).__name__}: {error}", "summary": [], "seconds": 0.0
+    }
+
+def run_account(
+    params_path: str,
+    output_folder: str,
+    loaded_rates: tuple[List[d.InterestSummary], List[d.InterestSummary]] | None
+) -> Dict[str, Any]:
+    """
+    Runs the full pipeline for one params file, writing its results, redacted statements
+    and console output (log.txt) to output_folder. Runs in a pool worker.
+
+    Args:
+        loaded_rates (tuple | None): Raw and collapsed rates from the shared extraction
+            (rates_for), None to extract them in the run (uses_shared_rates)
+
+    Returns:
+        Dict[str, Any]: The params path, whether it succeeded, the error if not, the
+        (label, principle, interest, balance) summary and how long it took
+    """
+    import main
+
+    os.makedirs(output_folder, exist_ok=True)
+    start = time.perf_counter()
+    result: Dict[str, Any] = {"params": params_path, "output": output_folder, "ok": False, "error": None, "summary": []}
+
+    with open(os.path.join(output_folder, "log.txt"), "w", encoding="utf-8") as log, redirect_stdout(log):
+        try:
+            config = load_config(params_path)
+            config["OUTPUT_FOLDER"] = output_folder
+            config["REDACT_FOLDER"] = os.path.join(output_folder, "redacted")
+
+            accounts = main.run(config, loaded_rates)
+            result["summary"] = main.summarize_accounts(accounts)
+            main.print_summary(result["summary"])
+            result["ok"] = True
+        except Exception as e:
+            traceback.print_exc(file=log)
+            result["error"] = f"{type(e).__name__}: {e}"
+
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def print_batch_summary(results: List[Dict[str, Any]]) -> None:
+    """
+    Prints the totals of every account in the batch, then the failures.
+    """
+    rows = []
+    for result in results:
+        name = os.path.basename(result["output"])
+        if result["ok"]:
+            summary = result["summary"]
+            rows.append([
+                name,
+                str(len(summary)),
+                u.format_currency(sum(s[1] for s in summary)),
+                u.format_currency(sum(s[2] for s in summary)),
+                u.format_currency(sum(s[3] for s in summary)),
+                f"{result['seconds']:.1f}s"
+            ])
+        else:
+            rows.append([name, "-", "-", "-", "failed", f"{result['seconds']:.1f}s"])
+    print(u.format_table(["Account", "Borrowers", "Principle", "Interest", "Balance Remaining", "Time"], rows))
+
+    succeeded = [result for result in results if result["ok"]]
+    total_interest = sum(s[2] for result in succeeded for s in result["summary"])
+    total_balance = sum(s[3] for result in succeeded for s in result["summary"])
+    print(f"Total Balance is {u.format_currency(total_balance)}")
+    print(f"Total Interest is {u.format_currency(total_interest)}")
+
+    for result in results:
+        if not result["ok"]:
+            print(f"{result['params']} failed, see {os.path.join(result['output'], 'log.txt')}: {result['error']}")
+
+def run_batch(
+    params_paths: List[str],
+    output_root: str,
+    workers: int = 1,
+    use_cache: bool = True,
+    check: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Runs the full pipeline for every params file, one process per account, each writing
+    to its own folder under output_root. An account that fails (its params, a statement
+    it needs or its run) is reported in its result, the others still run.
+
+    The statements of all accounts are extracted once up front with workers processes, in
+    place of each account's RATE_WORKERS. An account's RATE_CACHE (and use_cache) decides
+    whether its statements come from the rate cache, and an account with a STORE_PATH
+    extracts its rates in its own run (uses_shared_rates).
+
+    Args:
+        check (bool): Also extract every account's rates the way main.py run does and fail
+            the accounts where they differ (check_rates)
+
+    Returns:
+        List[Dict[str, Any]]: The result of every account in params order, see run_account
+    """
+    import lib.rates as r
+
+    folders = output_folders(params_paths, output_root)
+
+    # Only the statements are shared, anything else that fails only fails its own account
+    results: List[Dict[str, Any] | None] = [None] * len(params_paths)
+    shared: Dict[int, Params] = {}
+    selected: List[List[d.StatementSummary]] = [[] for _ in params_paths]
+    listings: Dict[str, List[d.StatementSummary]] = {}
+    for idx, path in enumerate(params_paths):
+        try:
+            config = load_config(path)
+            if uses_shared_rates(config):
+                selected[idx] = select_statements(config, listings)
+                shared[idx] = config
+        except Exception as e:
+            results[idx] = failed_result(path, folders[idx], e)
+
+    if any(config.get("CLEAR_RATE_CACHE", False) for config in shared.values()):
+        r.clear_rate_cache()
+
+    # Statements read past the cache first, so the accounts using it get them too
+    statement_rates: StatementRates = {}
+    errors: Dict[str, str] = {}
+    for cached in (False, True):
+        extract_shared_rates(
+            [selected[idx] for idx, config in shared.items() if (use_cache and config.get("RATE_CACHE", True)) == cached],
+            statement_rates, errors, cached, workers
+        )
+
+    loaded_rates: List[tuple[List[d.InterestSummary], List[d.InterestSummary]] | None] = [None] * len(params_paths)
+    for idx, config in shared.items():
+        try:
+            loaded_rates[idx] = rates = rates_for(config, listings, statement_rates, errors, use_cache, workers)
+            if check:
+                check_rates(config, rates)
+        except Exception as e:
+            results[idx] = failed_result(params_paths[idx], folders[idx], e)
+
+    pending = [idx for idx, result in enumerate(results) if result is None]
+    if workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                idx: pool.submit(run_account, params_paths[idx], folders[idx], loaded_rates[idx])
+                for idx in pending
+            }
+            for idx, future in futures.items():
+                results[idx] = future.result()
+    else:
+        for idx in pending:
+            results[idx] = run_account(params_paths[idx], folders[idx], loaded_rates[idx])
+
+    return [result for result in results if result is not None]
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the pipeline for many Vancity accounts.")
+    parser.add_argument("params", nargs="+", help="params files, or folders of them")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="accounts run at once (default: one per cpu)")
+    parser.add_argument("--output", help="results folder, one sub folder per params file (default: data/batch)")
+    parser.add_argument("--no-rate-cache", action="store_true", help="parse every statement instead of using the rate cache")
+    parser.add_argument("--check-rates", action="store_true", help="fail accounts whose rates differ from a single run of their params")
+    args = parser.parse_args(argv)
+
+    params_paths = find_params(args.params)
+    if not params_paths:
+        print("No params files found")
+        return 1
+
+    output_root = args.output or os.path.join(u.get_data_path(), "batch")
+    results = run_batch(params_paths, output_root, args.workers, not args.no_rate_cache, args.check_rates)
+    print_batch_summary(results)
+
+    return 0 if all(result["ok"] for result in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+ACCOUNT_NUMBER = "123456789012"
+# Day of the month the generated bank charges interest on, as main.INTEREST_DAY
+INTEREST_DAY = 14
+
+# Synthetic data
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return day.replace(year=day.year + month // 12, month=month % 12 + 1)
+
+def _summary_line(start: date, end: date, rate: float) -> str:
+    return f"{start.strftime('%d%b').upper()} TO {end.strftime('%d%b').upper()} : {rate * 100:.3f}%"
+
+def generate_statements(folder: str, start: date, end: date, rnd: random.Random) -> List[tuple[date, date, float]]:
+    """
+    Writes one statement PDF per month from start to end. Each covers the 15th to the
+    14th of the next month, so December statements wrap into January, and about a third
+    of them have a rate change splitting the period in two.
+
+    Returns:
+        List[tuple[date, date, float]]: The (start, end, rate) periods written, rates as
+        the statements print them
+    """
+    import fitz  # PyMuPDF
+
+    os.makedirs(folder, exist_ok=True)
+    period_start = _add_months(date(start.year, start.month, 15), -1)
+    rate = 0.0525
+    periods: List[tuple[date, date, float]] = []
+
+    while period_start <= end:
+        period_end = _add_months(period_start, 1) - timedelta(days=1)
+
+        if rnd.random() < 1 / 3:
+            split = period_start + timedelta(days=rnd.randint(3, 25))
+            parts = [(period_start, split, rate)]
+            rate = round(rate + rnd.choice([-0.0025, 0.0025]), 5)
+            parts.append((split + timedelta(days=1), period_end, rate))
+        else:
+            parts = [(period_start, period_end, rate)]
+        lines = [_summary_line(*part) for part in parts]
+        lines[0] = "INTEREST SUMMARY: " + lines[0]
+        # the rate as read back from the statement text
+        periods.extend((part_start, part_end, float(f"{part_rate * 100:.3f}") / 100) for part_start, part_end, part_rate in parts)
+
+        doc = fitz.open()
+        # a page of unrelated activity before the line of credit section
+        filler = doc.new_page()
+        for k in range(40):
+            filler.insert_text((50, 40 + k * 18), f"{period_start.strftime('%d%b').upper()} FUNDS TRANSFER {k:04d} 100.00 2,000.00")
+        page = doc.new_page()
+        page.insert_text((50, 50), f"#{ACCOUNT_NUMBER} LINE OF CREDIT DETAILS")
+        for k, line in enumerate(lines):
+            page.insert_text((50, 80 + k * 20), line)
+
+        name = f"statement-{ACCOUNT_NUMBER}-{period_end.replace(day=1).strftime('%y%b%d')}.pdf"
+        doc.save(os.path.join(folder, name))
+        doc.close()
+
+        period_start = period_end + timedelta(days=1)
+
+    return periods
+
+def generate_transactions(start: date, end: date, borrowers: int, tx_per_month: int, rnd: random.Random) -> tuple[List[List[Dict[str, Any]]], List[tuple[date, str, float]]]:
+    """
+    Draws the loan rows of every borrower and the bank transactions that back them, plus
+    unrelated bank activity so the account history is larger than the loans.
+
+    Returns:
+        tuple: Loan rows per borrower and the bank transactions as (date, description, amount)
+    """
+    loans: List[List[Dict[str, Any]]] = [[] for _ in range(borrowers)]
+    bank: List[tuple[date, str, float]] = []
+    days = (end - start).days
+
+    months = max(days // 30, 1)
+    for b in range(borrowers):
+        for _ in range(months * tx_per_month):
+            day = start + timedelta(days=rnd.randint(0, days))
+            if rnd.random() < 0.6:
+                amount = -round(rnd.uniform(50, 5000), 2)
+                description = "Official cheque  " + str(rnd.randint(1000, 9999))
+            else:
+                amount = round(rnd.uniform(50, 3000), 2)
+                description = "Funds Transfer  Online"
+            loans[b].append({"date": day.strftime("%Y-%m-%d"), "amount": amount, "type": description.split("  ")[0]})
+            bank.append((day, description, amount))
+
+    for _ in range(months * tx_per_month * 2):
+        day = start + timedelta(days=rnd.randint(0, days))
+        bank.append((day, "Point of Sale  Purchase", -round(rnd.uniform(1, 200), 2)))
+
+    for rows in loans:
+        rows.sort(key=lambda row: row["date"])
+    bank.sort(key=lambda tx: tx[0])
+
+    return loans, bank
+
+def generate_interest(
+    loans: List[List[Dict[str, Any]]],
+    periods: List[tuple[date, date, float]],
+    end: date,
+    rnd: random.Random
+) -> List[tuple[date, str, float]]:
+    """
+    Charges interest on the generated loans like the bank: on every charge day the interest
+    of all borrowers (computed by the interest engine from the statement rates) is posted as
+    one transaction, on the day or up to two days later.
+
+    Returns:
+        List[tuple[date, str, float]]: The interest transactions as (date, description, amount)
+    """
+    import lib.accounts as a
+    import lib.definitions as d
+    import lib.interest as i
+
+    rates = [
+        d.InterestSummary(datetime.combine(start, datetime.min.time()), datetime.combine(stop, datetime.min.time()), rate)
+        for start, stop, rate in periods
+    ]
+    accounts = i.calculate_interest_batch(
+        [a.dict_to_account({"label": f"borrower{b:03d}", "rows": rows}) for b, rows in enumerate(loans) if rows],
+        rates, INTEREST_DAY
+    )
+
+    # the bank charges the line of credit once, the sum of the borrowers' charges
+    per_day: Dict[int, int] = {}
+    for account in accounts:
+        for ordinal, type, cents in zip(account.rows.dates, account.rows.types, account.rows.amount_cents):
+            if type == "interest":
+                per_day[ordinal] = per_day.get(ordinal, 0) + cents
+
+    charges: List[tuple[date, str, float]] = []
+    for ordinal, cents in sorted(per_day.items()):
+        posted = date.fromordinal(ordinal) + timedelta(days=rnd.randint(0, 2))
+        charges.append((min(posted, end), "Interest  Line of Credit", cents / 100))
+    return charges
+
+def write_account_csv(path: str, bank: List[tuple[date, str, float]]) -> None:
+    """
+    Writes the bank transactions in the Vancity export format, newest first.
+    """
+    balance = 0.0
+    lines: List[str] = []
+    for day, description, amount in bank:
+        balance += amount
+        sub = f"{-amount:,.2f}" if amount < 0 else ""
+        add = f"{amount:,.2f}" if amount >= 0 else ""
+        lines.append(f'{ACCOUNT_NUMBER},{day.strftime("%d-%b-%Y")},"{description}",,"{sub}","{add}","{balance:,.2f}"')
+    lines.reverse()
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+def generate(folder: str, years: int, borrowers: int, tx_per_month: int, seed: int = 0) -> str:
+    """
+    Generates a synthetic data set in folder: statements/, account.csv and params.json.
+
+    Returns:
+        str: Path of the generated params.json
+    """
+    rnd = random.Random(seed)
+    end = date.today()
+    start = end - timedelta(days=365 * years)
+
+    statement_folder = os.path.join(folder, "statements")
+    periods = generate_statements(statement_folder, start, end, rnd)
+
+    loans, bank = generate_transactions(start, end, borrowers, tx_per_month, rnd)
+    bank.extend(generate_interest(loans, periods, end, rnd))
+    bank.sort(key=lambda tx: tx[0])
+    account_path = os.path.join(folder, "account.csv")
+    write_account_csv(account_path, bank)
+
+    params = {
+        "STATEMENT_FOLDER": statement_folder,
+        "VANCITY_PATH": account_path,
+        "VANCITY_ACCOUNT_NUMBER": ACCOUNT_NUMBER,
+        "REDACT_STATEMENTS": False,
+        "LOANS": [{"label": f"borrower{b:03d}", "rows": rows} for b, rows in enumerate(loans)]
+    }
+    params_path = os.path.join(folder, "params.json")
+    with open(params_path, "w", encoding="utf-8") as f:
+        json.dump(params, f, indent=2)
+
+    return params_path
+
+# Benchmark
+
+def _time(stages: Dict[str, float], name: str, repeat: int, func: Callable[[], Any]) -> Any:
+    """
+    Runs func repeat times and records the fastest run under name.
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    stages[name] = best
+    print(f"{name:<28} {best * 1000:10.1f} ms")
+    return result
+
+def run_benchmark(folder: str, repeat: int = 1) -> Dict[str, float]:
+    """
+    Times every stage of the pipeline against the data set in folder.
+
+    Returns:
+        Dict[str, float]: Fastest run of each stage in seconds
+    """
+    import lib.rates as r
+    import lib.vancity as v
+    import lib.accounts as a
+    import lib.interest as i
+    import lib.export as e
+    import lib.reconcile as rc
+    from config import load_config
+
+    config = load_config(os.path.join(folder, "params.json"))
+    stages: Dict[str, float] = {}
+    cache_path = os.path.join(folder, "cache", "rates.json")
+    data_path = os.path.join(folder, "data")
+
+    statements = _time(stages, "parse_statements", repeat, lambda: r.parse_statements(config["STATEMENT_FOLDER"]))
+    raw_rates = _time(stages, "get_rates", repeat, lambda: r.get_raw_rates(statements, use_cache=False))
+    r.get_raw_rates(statements, cache_path=cache_path)
+    _time(stages, "get_rates_cached", repeat, lambda: r.get_raw_rates(statements, cache_path=cache_path))
+    rates = _time(stages, "collapse_rates", repeat, lambda: r.collapse_rates(raw_rates))
+    account = _time(stages, "parse_csv", repeat, lambda: v.parse_csv(config["VANCITY_PATH"]))
+    loanAccounts = [a.dict_to_account(loan) for loan in config["LOANS"]]
+    report = _time(stages, "validate_transactions", repeat, lambda: a.validate_transactions(account, loanAccounts))
+    if not report.ok:
+        raise ValueError(f"synthetic data failed validation\n{report}")
+    _time(stages, "calculate_interest_rows", repeat, lambda: [i.calculate_interest_rows(loan, rates, INTEREST_DAY) for loan in loanAccounts])
+    accounts = _time(stages, "calculate_interest_batch", repeat, lambda: i.calculate_interest_batch(loanAccounts, rates, INTEREST_DAY))
+    reconciliation = _time(stages, "reconcile_interest", repeat, lambda: rc.reconcile_interest(account, accounts))
+    if not reconciliation.ok:
+        raise ValueError(f"synthetic data failed reconciliation\n{reconciliation}")
+    _time(stages, "export_csv", repeat, lambda: e.export_ledgers(account, raw_rates, rates, accounts, "csv", data_path))
+    _time(stages, "export_npz", repeat, lambda: e.export_ledgers(account, raw_rates, rates, accounts, "npz", data_path))
+
+    return stages
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic Vancity data.")
+    parser.add_argument("--years", type=int, default=5, help="years of history to generate")
+    parser.add_argument("--borrowers", type=int, default=10, help="number of borrowers")
+    parser.add_argument("--tx-per-month", type=int, default=2, help="loan transactions per borrower per month")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the generated data")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage, the fastest is reported")
+    parser.add_argument("--data-dir", help="generate into this folder and keep it (default: a temp folder)")
+    parser.add_argument("--output", help="results json (default: data/benchmarks/bench-<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    scale = {"years": args.years, "borrowers": args.borrowers, "tx_per_month": args.tx_per_month, "seed": args.seed}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = args.data_dir or tmp
+        os.makedirs(folder, exist_ok=True)
+
+        start = time.perf_counter()
+        generate(folder, args.years, args.borrowers, args.tx_per_month, args.seed)
+        print(f"Generated {scale} in {time.perf_counter() - start:.1f}s")
+
+        stages = run_benchmark(folder, args.repeat)
+
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "repeat": args.repeat,
+        "stages": stages
+    }
+
+    output = args.output
+    if output is None:
+        import lib.utils as u
+        folder = os.path.join(u.get_data_path(), "benchmarks")
+        os.makedirs(folder, exist_ok=True)
+        output = os.path.join(folder, f"bench-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote results to {output}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
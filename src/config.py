@@ -1,7 +1,6 @@
 import json
 import os
-from typing import TypedDict, List, Dict, Any
-import lib.definitions as d
+from typing import TypedDict, NotRequired, List, Dict, Any
 
 class Params(TypedDict):
     STATEMENT_FOLDER: str
@@ -11,8 +10,32 @@ class Params(TypedDict):
     LOANS: List[Dict[str, Any]]
     VANCITY_ACCOUNT_NUMBER: str
     REDACT_STATEMENTS: bool
+    REDACT_WORKERS: NotRequired[int]
+    RATE_CACHE: NotRequired[bool]
+    CLEAR_RATE_CACHE: NotRequired[bool]
+    RATE_WORKERS: NotRequired[int]
+    EXACT_INTEREST: NotRequired[bool]
+    INCREMENTAL_INTEREST: NotRequired[bool]
+    EXPORT_FORMAT: NotRequired[str]
+    OUTPUT_FOLDER: NotRequired[str]
+    REDACT_FOLDER: NotRequired[str]
+    STORE_PATH: NotRequired[str]
+    STAGE_WORKERS: NotRequired[int]
 
-# Load params.json from the project root
 root_dir = os.path.dirname(os.path.abspath(__file__))
-with open(os.path.join(root_dir, "../params.json"), "r") as f:
-    config: Params = json.load(f)
+DEFAULT_PARAMS_PATH = os.path.join(root_dir, "../params.json")
+
+def load_config(path: str | None = None) -> Params:
+    """
+    Loads the params file, params.json in the project root unless a path is given.
+    """
+    with open(path or DEFAULT_PARAMS_PATH, "r") as f:
+        return json.load(f)
+
+def __getattr__(name: str) -> Any:
+    # `from config import config` still works, but the file is only read on first use
+    if name == "config":
+        value = load_config()
+        globals()["config"] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
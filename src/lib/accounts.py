@@ -1,6 +1,6 @@
 import lib.definitions as d
 import lib.utils as u
-from collections import defaultdict
+from collections import Counter, defaultdict
 import os
 from typing import Any, Dict, List
 from datetime import datetime, date
@@ -43,7 +43,7 @@ def dict_to_row(json: Dict[str, Any]) -> d.AccountRow:
 def dict_to_account(json: Dict[str, Any]) -> d.Account:
     
     label: str = ""
-    rows: List[d.AccountRow] = []
+    rows = d.Ledger()
     currentBal = 0
     
     if "label" in json:
@@ -64,6 +64,14 @@ def dict_to_account(json: Dict[str, Any]) -> d.Account:
         totalPrinciple=0
     )
 
+def rate_window(loans: List[Dict[str, Any]]) -> tuple[date, date]:
+    """
+    Returns the first and last day interest is computed for the loans (json, as in params
+    LOANS): the earliest loan row through today.
+    """
+    days = [row.date for jsonAccount in loans for row in dict_to_account(jsonAccount).rows]
+    return (min(days).date() if days else date.today()), date.today()
+
 def get_row_map(account: d.Account) -> dict[str, d.AccountRow]:
     map: dict[str, d.AccountRow] = {}
     
@@ -74,41 +82,54 @@ def get_row_map(account: d.Account) -> dict[str, d.AccountRow]:
 
 def export_csv(file: str, account: d.Account) -> None:
     """
-    Exports the list of InterestSummary entries to a CSV file in the /data directory.
+    Exports the rows of an account to a CSV file in the /data directory.
+    Use export.export_ledgers to write all results of a run at once.
 
     Args:
-        file (str): File name (e.g. 'july_rates.csv')
-        rates (List[d.InterestSummary]): List of interest rate summaries
+        file (str): File name (e.g. 'interest_joe.csv')
+        account (d.Account): Account to export
     """
-    # Determine full path
-    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    data_path = os.path.join(root_dir, "data")
-    os.makedirs(data_path, exist_ok=True)
-
-    full_path = os.path.join(data_path, file)
+    import lib.export as e
 
-    with open(full_path, "w", encoding="utf-8") as f:
-        f.write("date,type,description,amount,balance\n")
-        for row in account.rows:
-            f.write(row.toCSV() + "\n")
+    full_path = os.path.join(u.get_data_path(), file)
+    e.write_account(full_path, account)
 
     print(f"Exported {len(account.rows)} entries to {full_path}")    
     
-def validate_transactions(statements: d.Account, loanAccounts: list[d.Account]):
-    row_map: dict[date, list[d.AccountRow]] = defaultdict(list)
-    
-    for row in statements.rows:
-        row_map[row.date.date()].append(row)
-    
+def validate_transactions(statements: d.Account, loanAccounts: list[d.Account]) -> d.ValidationReport:
+    """
+    Matches every loan row to its own bank transaction with the same date and amount.
+
+    Bank transactions are kept in a multiset keyed on (date, amount in cents) and each
+    match consumes one, so two borrowers cannot both claim the same transaction. A row left
+    over only because the same borrower already matched an identical row is unmatched, not
+    double claimed. Every loan row is checked and all problems are reported instead of
+    stopping at the first.
+
+    Returns:
+        d.ValidationReport: Matched count, unmatched rows and double claimed rows
+    """
+    available: Counter[tuple[int, int]] = Counter(zip(statements.rows.dates, statements.rows.amount_cents))
+
+    claims: dict[tuple[int, int], list[str]] = defaultdict(list)
+    matched = 0
+    unmatched: list[d.TransactionIssue] = []
+    double_claimed: list[d.TransactionIssue] = []
+
     for loanAccount in loanAccounts:
-        for row in loanAccount.rows:
-            if row.date.date() not in row_map:
-                raise ValueError(f"could not find transaction by {loanAccount.label} on {row.date.date()}")
-            isEqual = False
-            for rr in row_map[row.date.date()]:
-                if rr.amount == row.amount:
-                    isEqual = True
-                    
-            if not isEqual:
-                raise ValueError(f"could not find transaction by {loanAccount.label} on {row.date.date()} with amount {u.format_currency(row.amount)}")
-            
\ No newline at end of file
+        rows = loanAccount.rows
+        for idx, key in enumerate(zip(rows.dates, rows.amount_cents)):
+            if available[key] > 0:
+                available[key] -= 1
+                claims[key].append(loanAccount.label)
+                matched += 1
+            elif any(label != loanAccount.label for label in claims[key]):
+                double_claimed.append(d.TransactionIssue(loanAccount.label, rows[idx], list(claims[key])))
+            else:
+                unmatched.append(d.TransactionIssue(loanAccount.label, rows[idx], []))
+
+    return d.ValidationReport(
+        matched=matched,
+        unmatched=unmatched,
+        double_claimed=double_claimed
+    )
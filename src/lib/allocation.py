@@ -0,0 +1,110 @@
+from typing import List
+import numpy as np
+import lib.definitions as d
+from lib.reconcile import interest_type_pattern, sum_by_day
+
+def allocate_bank_interest(account: d.Account, loanAccounts: List[d.Account]) -> d.InterestAllocation:
+    """
+    Splits every interest charge in the account history across the borrowers, pro rata by
+    what each owed over the days the charge covers (the day after the previous charge
+    through the charge day).
+
+    The principal balance of every borrower at the end of every day is built as one
+    (borrowers x days) array and summed over days once, so the weights of all borrowers
+    and all charges come from a single difference of running sums. Charges are split in
+    whole cents by largest remainder, so the shares of a charge add up to exactly what the
+    bank charged. Weights are principal balances only: counting allocated interest would
+    make every charge depend on the split of the one before.
+
+    Args:
+        account (d.Account): Parsed account history (parse_csv)
+        loanAccounts (List[d.Account]): Loan rows of every borrower
+
+    Returns:
+        d.InterestAllocation: Every charge and the cents allocated to each borrower
+    """
+    labels = [loanAccount.label for loanAccount in loanAccounts]
+    bank_days, bank_amounts, _ = account.rows.columns()
+    is_interest = np.fromiter(
+        (interest_type_pattern.search(t or "") is not None for t in account.rows.types),
+        dtype=bool, count=len(account.rows)
+    )
+    charge_days, charges = sum_by_day(bank_days[is_interest], bank_amounts[is_interest])
+
+    ledgers = [loanAccount.rows.columns() for loanAccount in loanAccounts]
+    n_rows = [len(days) for days, _, _ in ledgers]
+    if not len(charge_days) or not sum(n_rows):
+        return d.InterestAllocation(labels, charge_days, charges, np.zeros((len(charges), len(labels)), dtype=np.int64), charges.copy())
+
+    # Principal owed by every borrower at the end of every day, from the first loan row to the last charge
+    loan_days = np.concatenate([days for days, _, _ in ledgers])
+    loan_amounts = np.concatenate([amounts for _, amounts, _ in ledgers])
+    borrowers = np.repeat(np.arange(len(labels)), n_rows)
+    first = int(loan_days.min())
+    n_days = max(int(charge_days[-1]), int(loan_days.max())) - first + 1
+    balances = np.zeros((len(labels), n_days), dtype=np.int64)
+    np.add.at(balances, (borrowers, loan_days - first), loan_amounts)
+    owed = np.maximum(0, -np.cumsum(balances, axis=1))
+
+    # Owed summed over each charge's days, as a difference of running sums
+    running = np.zeros((len(labels), n_days + 1), dtype=np.int64)
+    np.cumsum(owed, axis=1, out=running[:, 1:])
+    ends = np.clip(charge_days - first + 1, 0, n_days)
+    starts = np.concatenate(([0], ends[:-1]))
+    weights = (running[:, ends] - running[:, starts]).T  # (charges, borrowers)
+    total = weights.sum(axis=1)
+
+    # Largest remainder split of the magnitude, in whole cents
+    magnitude = np.abs(charges)
+    safe_total = np.maximum(total, 1)[:, None]
+    shares, remainders = np.divmod(magnitude[:, None] * weights, safe_total)
+    short = magnitude - shares.sum(axis=1)
+    rank = np.argsort(np.argsort(-remainders, axis=1, kind="stable"), axis=1, kind="stable")
+    shares += rank < short[:, None]
+    shares *= np.sign(charges)[:, None]
+
+    owes = total > 0
+    shares[~owes] = 0
+    return d.InterestAllocation(labels, charge_days, charges, shares, np.where(owes, 0, charges))
+
+def allocation_ledgers(loanAccounts: List[d.Account], allocation: d.InterestAllocation) -> List[d.Account]:
+    """
+    Builds the ledger of every borrower with their share of each bank charge as interest
+    rows, posted on the charge day after that day's loan rows.
+    """
+    accounts: List[d.Account] = []
+    for b, loanAccount in enumerate(loanAccounts):
+        days, amounts, _ = loanAccount.rows.columns()
+        order = np.argsort(days, kind="stable").tolist()
+        charges = [
+            (int(day), int(cents)) for day, cents in zip(allocation.charge_days, allocation.allocated[:, b])
+            if cents != 0
+        ]
+
+        rows = d.Ledger()
+        balance = principle = interest = 0
+        k = 0
+        for idx in order + [None]:
+            day = int(days[idx]) if idx is not None else None
+            # charges posted before this row's day, all remaining ones after the last row
+            while k < len(charges) and (day is None or charges[k][0] < day):
+                charge_day, cents = charges[k]
+                balance += cents
+                interest += cents
+                rows.append_cents(charge_day, "interest", "Allocated bank interest", cents, balance)
+                k += 1
+            if idx is None:
+                break
+            amount = int(amounts[idx])
+            balance += amount
+            principle += amount
+            rows.append_cents(day, "payment" if amount > 0 else "loan", loanAccount.rows.descriptions[idx], amount, balance)
+
+        accounts.append(d.Account(
+            label=loanAccount.label,
+            rows=rows,
+            totalInterest=interest / 100,
+            totalPrinciple=principle / 100,
+            currBalance=balance / 100
+        ))
+    return accounts
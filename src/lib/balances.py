@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+from datetime import date
+from typing import List, Tuple
+import numpy as np
+import lib.definitions as defs
+import lib.export as e
+
+# Bumped whenever the saved layout or the engine changes, older index files are then rebuilt
+INDEX_VERSION = 1
+
+class BalanceIndex:
+    """
+    Point in time index over the interest ledger of one borrower.
+
+    Holds the sorted day ordinals of every event of the interest calculation (payments,
+    rate changes and charge days) with, as of the end of each event day, the running
+    principal, the running interest charged and the interest accrued but not yet charged,
+    plus the interest accruing per day until the next event. Any day is answered with one
+    binary search, the days between two events follow from the daily accrual.
+
+    Built by calculate_interest_rows(..., with_index=True).
+    """
+
+    def __init__(
+        self,
+        events: List[Tuple[int, float, float, float, float]],
+        end: date,
+        money_scale: int = 1,
+        accrued_scale: int = 1
+    ):
+        """
+        Args:
+            events (List[Tuple[int, float, float, float, float]]): (ordinal, principal, charged,
+                accrued, daily accrual) at the end of each event day, in day order
+            end (date): Last day the calculation covers
+            money_scale (int): Units per dollar of principal and charged interest (100 for cents)
+            accrued_scale (int): Units per dollar of accrued interest
+        """
+        exact = money_scale != 1
+        money = np.int64 if exact else float
+        self.ordinals = np.array([e[0] for e in events], dtype=np.int64)
+        self.principal = np.array([e[1] for e in events], dtype=money)
+        self.charged = np.array([e[2] for e in events], dtype=money)
+        self.accrued = np.array([e[3] for e in events], dtype=money)
+        self.daily = np.array([e[4] for e in events], dtype=money)
+        self.end = end
+        self.money_scale = money_scale
+        self.accrued_scale = accrued_scale
+
+    def __len__(self) -> int:
+        return len(self.ordinals)
+
+    def save(self, full_path: str, key: str) -> None:
+        """
+        Writes the index to a .npz file, with the key it was built for (see index_key).
+        """
+        e.write_npz(
+            full_path,
+            meta=np.array(json.dumps({
+                "key": key,
+                "end": self.end.toordinal(),
+                "money_scale": self.money_scale,
+                "accrued_scale": self.accrued_scale
+            })),
+            ordinals=self.ordinals,
+            principal=self.principal,
+            charged=self.charged,
+            accrued=self.accrued,
+            daily=self.daily
+        )
+
+    @classmethod
+    def load(cls, full_path: str, key: str) -> "BalanceIndex | None":
+        """
+        Loads an index written by save, or returns None if there is none or it was built
+        for another key.
+        """
+        if not os.path.exists(full_path):
+            return None
+        try:
+            columns = e.load_columns(full_path)
+            meta = json.loads(str(columns["meta"]))
+        except (OSError, ValueError, KeyError) as ex:
+            print(f"Ignoring unreadable index {full_path}: {ex}")
+            return None
+        if meta.get("key") != key:
+            return None
+        index = cls([], date.fromordinal(meta["end"]), meta["money_scale"], meta["accrued_scale"])
+        index.ordinals = columns["ordinals"]
+        index.principal = columns["principal"]
+        index.charged = columns["charged"]
+        index.accrued = columns["accrued"]
+        index.daily = columns["daily"]
+        return index
+
+    def _find(self, day: date) -> Tuple[int, int]:
+        """
+        Returns the index of the last event on or before day (-1 before the first) and the day ordinal.
+
+        Raises:
+            ValueError if the day is after the end of the calculation.
+        """
+        if day.toordinal() > self.end.toordinal():
+            raise ValueError(f"{date.fromordinal(day.toordinal())} is after the end of the interest calculation ({self.end})")
+        ordinal = day.toordinal()
+        return int(np.searchsorted(self.ordinals, ordinal, side="right")) - 1, ordinal
+
+    def _accrued(self, idx: int, ordinal: int) -> float:
+        if idx < 0:
+            return 0.0
+        units = self.accrued[idx] + (ordinal - self.ordinals[idx]) * self.daily[idx]
+        return float(units) / self.accrued_scale
+
+    def principal_at(self, day: date) -> float:
+        """
+        Returns the sum of the loans and payments up to and including day.
+        """
+        idx, _ = self._find(day)
+        return float(self.principal[idx]) / self.money_scale if idx >= 0 else 0.0
+
+    def charged_at(self, day: date) -> float:
+        """
+        Returns the interest charged up to and including day.
+        """
+        idx, _ = self._find(day)
+        return float(self.charged[idx]) / self.money_scale if idx >= 0 else 0.0
+
+    def balance_at(self, day: date) -> float:
+        """
+        Returns the ledger balance at the end of day, principal plus interest charged.
+        """
+        idx, _ = self._find(day)
+        if idx < 0:
+            return 0.0
+        return float(self.principal[idx] + self.charged[idx]) / self.money_scale
+
+    def accrued_at(self, day: date) -> float:
+        """
+        Returns the interest accrued by the end of day that has not been charged yet.
+        """
+        return self._accrued(*self._find(day))
+
+    def owed_at(self, day: date) -> float:
+        """
+        Returns what is owed at the end of day, the balance plus the accrued, uncharged interest.
+        """
+        return self.balance_at(day) + self.accrued_at(day)
+
+    def interest_between(self, start: date, end: date, include_accrued: bool = False) -> float:
+        """
+        Returns the interest charged from start through end (inclusive).
+
+        With include_accrued, interest is counted as it accrues instead, so days whose
+        interest has not been charged yet are included.
+        """
+        if end < start:
+            raise ValueError(f"Start {start} is after end {end}")
+        before = date.fromordinal(start.toordinal() - 1)
+        interest = self.charged_at(end) - self.charged_at(before)
+        if include_accrued:
+            interest += self.accrued_at(end) - self.accrued_at(before)
+        return interest
+
+def index_key(account: defs.Account, rates_fingerprint: str, interest_day: int, exact: bool, end: date) -> str:
+    """
+    Returns the key a saved index of the account is valid for: a hash of its rows, the
+    rates it was computed from (e.g. fingerprint_statements), the interest settings and
+    the last day covered.
+    """
+    dates, amounts, _ = account.rows.columns()
+    digest = hashlib.sha256()
+    digest.update(dates.tobytes())
+    digest.update(amounts.tobytes())
+    digest.update(json.dumps([INDEX_VERSION, rates_fingerprint, interest_day, exact, end.toordinal()]).encode("utf-8"))
+    return digest.hexdigest()
@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+from datetime import date
+from decimal import ROUND_HALF_UP
+from typing import Any, Dict, List, Tuple
+import numpy as np
+import lib.definitions as defs
+import lib.export as e
+from lib.interest import payments_by_day, run_interest_rows, to_interest_account
+from lib.schedule import RateSchedule, as_schedule
+
+# Bumped whenever the engine or the file layout changes, older checkpoints are then ignored
+CHECKPOINT_VERSION = 1
+
+def _row_keys(account: defs.Account) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    Returns the (day ordinal, amount in cents, description) of every row, sorted by day.
+    Rows of the same day keep their order, it is the order they are applied in.
+    """
+    dates, amounts, _ = account.rows.columns()
+    order = np.argsort(dates, kind="stable")
+    amounts = amounts[order]
+    descriptions = [account.rows.descriptions[i] or "" for i in order.tolist()]
+    return dates[order], amounts, descriptions
+
+def _rows_hash(dates: np.ndarray, amounts: np.ndarray, descriptions: List[str]) -> str:
+    digest = hashlib.sha256()
+    digest.update(dates.tobytes())
+    digest.update(amounts.tobytes())
+    digest.update("\n".join(descriptions).encode("utf-8"))
+    return digest.hexdigest()
+
+def _schedule_hash(schedule: RateSchedule) -> str:
+    digest = hashlib.sha256()
+    for column in (schedule.starts, schedule.ends, schedule.rates):
+        digest.update(np.ascontiguousarray(column).tobytes())
+    return digest.hexdigest()
+
+def _first_row_change(old: Dict[str, np.ndarray], dates: np.ndarray, amounts: np.ndarray, descriptions: List[str]) -> int | None:
+    """
+    Returns the first day whose rows differ from the checkpoint, or None if they are the same.
+    """
+    old_descriptions = old["row_descriptions"].tolist()
+    n = min(len(old["row_dates"]), len(dates))
+    same = (old["row_dates"][:n] == dates[:n]) & (old["row_amounts"][:n] == amounts[:n])
+    same &= np.array([a == b for a, b in zip(old_descriptions[:n], descriptions[:n])], dtype=bool)
+    k = int(np.argmin(same)) if n and not same.all() else n
+    if k < n:
+        return int(min(old["row_dates"][k], dates[k]))
+    if len(dates) > n:
+        return int(dates[n])
+    if len(old["row_dates"]) > n:
+        return int(old["row_dates"][n])
+    return None
+
+def _first_rate_change(old: RateSchedule, new: RateSchedule) -> int | None:
+    """
+    Returns the first day the rate in effect (or whether there is one) differs between
+    the schedules, or None if they agree on every day. A segment split in two at the same
+    rate counts as a change, since the engine visits every boundary.
+    """
+    old_boundaries = set(old.boundaries().tolist())
+    new_boundaries = set(new.boundaries().tolist())
+    points = np.array(sorted(old_boundaries | new_boundaries), dtype=np.int64)
+    if not len(points):
+        return None
+    old_rates, old_covered = old.lookup(points)
+    new_rates, new_covered = new.lookup(points)
+    differs = (old_rates != new_rates) | (old_covered != new_covered)
+    differs |= np.array([(p in old_boundaries) != (p in new_boundaries) for p in points.tolist()], dtype=bool)
+    return int(points[np.argmax(differs)]) if differs.any() else None
+
+def _schedule_from(columns: Dict[str, np.ndarray]) -> RateSchedule:
+    schedule = RateSchedule([])
+    schedule.starts = columns["schedule_starts"]
+    schedule.ends = columns["schedule_ends"]
+    schedule.rates = columns["schedule_rates"]
+    return schedule
+
+def _ledger_from(columns: Dict[str, np.ndarray], n_rows: int) -> defs.Ledger:
+    rows = defs.Ledger()
+    for ordinal, type, description, amount, balance in zip(
+        columns["ledger_dates"][:n_rows].tolist(),
+        columns["ledger_types"][:n_rows].tolist(),
+        columns["ledger_descriptions"][:n_rows].tolist(),
+        columns["ledger_amounts"][:n_rows].tolist(),
+        columns["ledger_balances"][:n_rows].tolist()
+    ):
+        rows.append_cents(ordinal, type or None, description or None, amount, balance)
+    return rows
+
+def _state_from(values: np.ndarray, exact: bool) -> Tuple[Any, Any, Any, Any]:
+    # back to python numbers so the engine does the same arithmetic as a full run
+    return tuple(int(v) if exact else float(v) for v in values.tolist())  # type: ignore[return-value]
+
+def _load(path: str) -> Dict[str, np.ndarray] | None:
+    if not os.path.exists(path):
+        return None
+    try:
+        return e.load_columns(path)
+    except (OSError, ValueError) as ex:
+        print(f"Ignoring unreadable checkpoint {path}: {ex}")
+        return None
+
+def _save(
+    path: str,
+    meta: Dict[str, Any],
+    keys: Tuple[np.ndarray, np.ndarray, List[str]],
+    schedule: RateSchedule,
+    rows: defs.Ledger,
+    state: Tuple[Any, Any, Any, Any],
+    snapshots: List[Tuple[int, Any, Any, Any, Any, int]],
+    exact: bool
+) -> None:
+    dates, amounts, descriptions = keys
+    e.write_npz(
+        path,
+        meta=np.array(json.dumps(meta)),
+        row_dates=dates,
+        row_amounts=amounts,
+        row_descriptions=e.text_column(descriptions),
+        schedule_starts=schedule.starts,
+        schedule_ends=schedule.ends,
+        schedule_rates=schedule.rates,
+        state=np.array(state, dtype=np.int64 if exact else float),
+        snapshot_dates=np.array([s[0] for s in snapshots], dtype=np.int64),
+        snapshot_states=np.array([s[1:5] for s in snapshots], dtype=np.int64 if exact else float).reshape(-1, 4),
+        snapshot_rows=np.array([s[5] for s in snapshots], dtype=np.int64),
+        ledger_dates=np.frombuffer(rows.dates, dtype=np.int32),
+        ledger_types=e.text_column(rows.types),
+        ledger_descriptions=e.text_column(rows.descriptions),
+        ledger_amounts=np.frombuffer(rows.amount_cents, dtype=np.int64),
+        ledger_balances=np.frombuffer(rows.balance_cents, dtype=np.int64)
+    )
+
+def calculate_interest_incremental(
+    accounts: List[defs.Account],
+    interest_summaries: List[defs.InterestSummary] | RateSchedule,
+    checkpoint_folder: str,
+    interest_day: int = 15,
+    exact: bool = False,
+    rounding: str = ROUND_HALF_UP
+) -> List[defs.Account]:
+    """
+    Computes the interest ledger of every borrower like calculate_interest_rows, reusing the
+    work of the previous run.
+
+    Every borrower gets a checkpoint in checkpoint_folder (<label>.npz) holding the state
+    (balance, accrued interest and totals) after each charge day, the ledger, the last day
+    computed and what it was computed from: the borrower's rows and the rate schedule, with
+    a hash of each. On the next run the first day anything differs is found (a changed or
+    new row, a changed rate, or simply the days since the last run) and the borrower resumes
+    from the last charge day before it, keeping the ledger up to there. Borrowers whose
+    hashes match and that are already computed up to today are not computed at all.
+
+    Charge days are the only resume points, and the engine always visits the day after one,
+    so a resumed borrower gets exactly the result a full recomputation would give.
+
+    Args:
+        accounts (List[defs.Account]): Loan accounts, one per borrower
+        interest_summaries (List[defs.InterestSummary] | RateSchedule): Interest rates
+        checkpoint_folder (str): Folder the checkpoints are kept in
+        interest_day (int): Day of the month interest is charged on
+        exact (bool): Compute in int cents, see calculate_interest_rows
+        rounding (str): Rounding policy of exact mode
+
+    Returns:
+        List[defs.Account]: The interest account of every borrower, in order
+    """
+    os.makedirs(checkpoint_folder, exist_ok=True)
+    schedule = as_schedule(interest_summaries)
+    rates_hash = _schedule_hash(schedule)
+    today = date.today()
+    counts = {"unchanged": 0, "resumed": 0, "recomputed": 0}
+
+    results: List[defs.Account] = []
+    for account in accounts:
+        path = os.path.join(checkpoint_folder, f"{account.label}.npz")
+        keys = _row_keys(account)
+        meta = {
+            "version": CHECKPOINT_VERSION,
+            "rows_hash": _rows_hash(*keys),
+            "rates_hash": rates_hash,
+            "interest_day": interest_day,
+            "exact": exact,
+            "rounding": rounding,
+        }
+
+        old = _load(path)
+        old_meta = json.loads(str(old["meta"])) if old is not None else {}
+        same_setup = old is not None and all(old_meta.get(k) == meta[k] for k in ("version", "interest_day", "exact", "rounding"))
+
+        # First day that needs computing, None for a full run
+        change: int | None = None
+        if same_setup:
+            assert old is not None
+            candidates = [old_meta["last_date"] + 1]
+            if old_meta["rows_hash"] != meta["rows_hash"]:
+                candidates.append(_first_row_change(old, *keys))
+            if old_meta["rates_hash"] != rates_hash:
+                candidates.append(_first_rate_change(_schedule_from(old), schedule))
+            change = min(c for c in candidates if c is not None)
+
+        if same_setup and change is not None and change > today.toordinal():
+            assert old is not None
+            rows = _ledger_from(old, len(old["ledger_dates"]))
+            state = _state_from(old["state"], exact)
+            results.append(to_interest_account(account.label, rows, state, exact))
+            counts["unchanged"] += 1
+            continue
+
+        payment_map = payments_by_day(account)
+        start = min(payment_map.keys())
+        snapshots: List[Tuple[int, Any, Any, Any, Any, int]] = []
+        rows = None
+        state = None
+
+        # Resume from the last charge day before the change
+        if same_setup and change is not None:
+            assert old is not None
+            k = int(np.searchsorted(old["snapshot_dates"], change, side="left")) - 1
+            if k >= 0:
+                n_rows = int(old["snapshot_rows"][k])
+                snapshots = [
+                    (int(ordinal), *_state_from(s, exact), int(n))
+                    for ordinal, s, n in zip(old["snapshot_dates"][:k + 1], old["snapshot_states"][:k + 1], old["snapshot_rows"][:k + 1])
+                ]
+                rows = _ledger_from(old, n_rows)
+                state = _state_from(old["snapshot_states"][k], exact)
+                start = date.fromordinal(int(old["snapshot_dates"][k]) + 1)
+
+        counts["resumed" if state is not None else "recomputed"] += 1
+        rows, state = run_interest_rows(
+            payment_map, schedule, start, today, interest_day, exact, rounding,
+            state=state, rows=rows, snapshots=snapshots
+        )
+        results.append(to_interest_account(account.label, rows, state, exact))
+
+        meta["last_date"] = today.toordinal()
+        _save(path, meta, keys, schedule, rows, state, snapshots, exact)
+
+    print(f"Interest checkpoints: {counts['unchanged']} unchanged, {counts['resumed']} resumed, {counts['recomputed']} recomputed")
+    return results
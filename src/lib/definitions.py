@@ -1,12 +1,24 @@
-from datetime import datetime
-from dataclasses import dataclass
+import sys
+from array import array
+from datetime import datetime, date
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, overload
 import lib.utils as u
 
+if TYPE_CHECKING:
+    import numpy as np
+
 @dataclass
 class StatementSummary:
     path: str
     date: datetime
 
+@dataclass
+class RedactionSummary:
+    processed: int
+    skipped: int
+    failed: list[str]
+
 @dataclass
 class InterestSummary:
     start: datetime
@@ -17,7 +29,7 @@ class InterestSummary:
         return f"{self.start.date()} to {self.end.date()} @ {self.rate:.2%}"
     def toCSV(self):
         return f"{self.start.date()},{self.end.date()},{self.rate}"
-@dataclass
+@dataclass(slots=True)
 class AccountRow:
     date: datetime
     type: str | None
@@ -31,11 +43,257 @@ class AccountRow:
     def toCSV(self):
         return f"{self.date.date()},{self.type},{self.description},{self.amount},{self.balance}"
     
+def _intern(value: str | None) -> str | None:
+    return None if value is None else sys.intern(value)
+
+class Ledger:
+    """
+    Column-backed list of AccountRow.
+
+    Dates are stored as day ordinals and amounts and balances as int64 cents, with the
+    type and description strings interned, so a ledger costs a few dozen bytes per row
+    instead of a dataclass and a datetime. Rows are materialized on access, so it can be
+    iterated, indexed, assigned to and appended to like the list it replaces. Money is held
+    in whole cents, amounts with more precision are rounded to the cent when stored, and
+    only the day of a date is kept, its time of day is dropped.
+
+    Indexing returns a copy of the row, changing it does not change the ledger. Assign it
+    back instead: row = ledger[i]; row.amount = 5.0; ledger[i] = row.
+    """
+    __slots__ = ("dates", "types", "descriptions", "amount_cents", "balance_cents")
+
+    def __init__(self, rows: Iterable[AccountRow] = ()):
+        self.dates = array("i")
+        self.types: list[str | None] = []
+        self.descriptions: list[str | None] = []
+        self.amount_cents = array("q")
+        self.balance_cents = array("q")
+        self.extend(rows)
+
+    def append(self, row: AccountRow) -> None:
+        self.append_cents(row.date.toordinal(), row.type, row.description, u.to_cents(row.amount), u.to_cents(row.balance))
+
+    def append_cents(self, ordinal: int, type: str | None, description: str | None, amount_cents: int, balance_cents: int) -> None:
+        self.dates.append(ordinal)
+        self.types.append(_intern(type))
+        self.descriptions.append(_intern(description))
+        self.amount_cents.append(amount_cents)
+        self.balance_cents.append(balance_cents)
+
+    def extend(self, rows: Iterable[AccountRow]) -> None:
+        for row in rows:
+            self.append(row)
+
+    def _row(self, idx: int) -> AccountRow:
+        return AccountRow(
+            date=datetime.combine(date.fromordinal(self.dates[idx]), datetime.min.time()),
+            type=self.types[idx],
+            description=self.descriptions[idx],
+            amount=self.amount_cents[idx] / 100,
+            balance=self.balance_cents[idx] / 100
+        )
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def __iter__(self) -> Iterator[AccountRow]:
+        for idx in range(len(self.dates)):
+            yield self._row(idx)
+
+    @overload
+    def __getitem__(self, idx: int) -> AccountRow: ...
+    @overload
+    def __getitem__(self, idx: slice) -> "Ledger": ...
+    def __getitem__(self, idx: int | slice) -> "AccountRow | Ledger":
+        if isinstance(idx, slice):
+            return self._take(range(len(self))[idx])
+        return self._row(range(len(self))[idx])
+
+    def _set(self, idx: int, row: AccountRow) -> None:
+        self.dates[idx] = row.date.toordinal()
+        self.types[idx] = _intern(row.type)
+        self.descriptions[idx] = _intern(row.description)
+        self.amount_cents[idx] = u.to_cents(row.amount)
+        self.balance_cents[idx] = u.to_cents(row.balance)
+
+    @overload
+    def __setitem__(self, idx: int, row: AccountRow) -> None: ...
+    @overload
+    def __setitem__(self, idx: slice, row: Iterable[AccountRow]) -> None: ...
+    def __setitem__(self, idx: int | slice, row: "AccountRow | Iterable[AccountRow]") -> None:
+        if isinstance(idx, slice):
+            indices = range(len(self))[idx]
+            rows = list(row)  # type: ignore[arg-type]
+            if len(rows) != len(indices):
+                raise ValueError(f"Cannot assign {len(rows)} rows to a slice of {len(indices)}, a ledger slice keeps its length")
+            for k, r in zip(indices, rows):
+                self._set(k, r)
+        else:
+            self._set(range(len(self))[idx], row)  # type: ignore[arg-type]
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Ledger):
+            return NotImplemented
+        return (
+            self.dates == other.dates
+            and self.amount_cents == other.amount_cents
+            and self.balance_cents == other.balance_cents
+            and self.types == other.types
+            and self.descriptions == other.descriptions
+        )
+
+    def columns(self) -> "tuple[np.ndarray, np.ndarray, np.ndarray]":
+        """
+        Returns the day ordinals (int64), amounts and balances (int64 cents) as numpy arrays.
+        Amounts and balances share memory with the ledger, so copy them before appending.
+        """
+        import numpy as np
+        return (
+            np.frombuffer(self.dates, dtype=np.int32).astype(np.int64),
+            np.frombuffer(self.amount_cents, dtype=np.int64),
+            np.frombuffer(self.balance_cents, dtype=np.int64)
+        )
+
+    def _take(self, order: Iterable[int]) -> "Ledger":
+        order = list(order)
+        ledger = Ledger()
+        ledger.dates = array("i", (self.dates[k] for k in order))
+        ledger.types = [self.types[k] for k in order]
+        ledger.descriptions = [self.descriptions[k] for k in order]
+        ledger.amount_cents = array("q", (self.amount_cents[k] for k in order))
+        ledger.balance_cents = array("q", (self.balance_cents[k] for k in order))
+        return ledger
+
+    def sort(self, key: Callable[[AccountRow], Any] | None = None) -> None:
+        """
+        Stable in-place sort, by date unless another key is given.
+        """
+        if key is None:
+            order = sorted(range(len(self)), key=self.dates.__getitem__)
+        else:
+            order = sorted(range(len(self)), key=lambda k: key(self._row(k)))
+        sorted_ledger = self._take(order)
+        self.dates = sorted_ledger.dates
+        self.types = sorted_ledger.types
+        self.descriptions = sorted_ledger.descriptions
+        self.amount_cents = sorted_ledger.amount_cents
+        self.balance_cents = sorted_ledger.balance_cents
+
+    def toCSV(self) -> Iterator[str]:
+        for idx in range(len(self.dates)):
+            yield f"{date.fromordinal(self.dates[idx])},{self.types[idx]},{self.descriptions[idx]},{self.amount_cents[idx] / 100},{self.balance_cents[idx] / 100}"
+
+    def __repr__(self) -> str:
+        return f"Ledger({len(self)} rows)"
+
 @dataclass
 class Account:
     label: str
-    rows: list[AccountRow]
+    rows: Ledger
     totalInterest: float
     totalPrinciple: float
-    currBalance: float        
-    
\ No newline at end of file
+    currBalance: float
+
+    def __post_init__(self):
+        # accept plain lists of rows from older callers
+        if not isinstance(self.rows, Ledger):
+            self.rows = Ledger(self.rows)
+
+@dataclass
+class TransactionIssue:
+    label: str
+    row: AccountRow
+    claimed_by: list[str]  # borrowers that already matched the bank transaction
+
+    def __str__(self):
+        message = f"{self.label} on {self.row.date.date()} with amount {u.format_currency(self.row.amount)}"
+        if self.claimed_by:
+            return f"{message} was already claimed by {', '.join(self.claimed_by)}"
+        return f"could not find transaction by {message}"
+
+@dataclass
+class ValidationReport:
+    matched: int
+    unmatched: list[TransactionIssue]
+    double_claimed: list[TransactionIssue]
+
+    @property
+    def ok(self) -> bool:
+        return not self.unmatched and not self.double_claimed
+
+    def __str__(self):
+        lines = [f"{self.matched} transactions matched, {len(self.unmatched)} unmatched, {len(self.double_claimed)} double claimed"]
+        for issue in self.unmatched + self.double_claimed:
+            lines.append(f"  {issue}")
+        return "\n".join(lines)
+
+@dataclass
+class InterestDiscrepancy:
+    date: date
+    bank: float
+    computed: float  # total over all borrowers
+
+    def __str__(self):
+        return (f"{self.date}: bank charged {u.format_currency(self.bank)}, computed {u.format_currency(self.computed)}"
+                f" (off by {u.format_currency(self.bank - self.computed)})")
+
+@dataclass
+class ReconciliationReport:
+    charge_days: int
+    bank_interest: float
+    computed_interest: float
+    discrepancies: list[InterestDiscrepancy]
+    first_divergence: date | None  # first day the borrower balances drift from the bank's
+    drift: float  # bank minus borrower balance on the last day compared
+
+    @property
+    def ok(self) -> bool:
+        return not self.discrepancies and self.first_divergence is None
+
+    def __str__(self):
+        limit = 10  # discrepancies listed, the rest are counted
+        lines = [
+            f"{self.charge_days} charge days reconciled, bank charged {u.format_currency(self.bank_interest)}, "
+            f"computed {u.format_currency(self.computed_interest)}, {len(self.discrepancies)} differ"
+        ]
+        if self.first_divergence is not None:
+            lines.append(f"  balances diverge from {self.first_divergence}, off by {u.format_currency(self.drift)} at the end")
+        for discrepancy in self.discrepancies[:limit]:
+            lines.append(f"  {discrepancy}")
+        if len(self.discrepancies) > limit:
+            lines.append(f"  ... and {len(self.discrepancies) - limit} more")
+        return "\n".join(lines)
+
+@dataclass
+class AccountColumns:
+    label: str
+    dates: "np.ndarray"  # day ordinals
+    types: list[str]
+    descriptions: list[str]
+    amounts: "np.ndarray"
+    balances: "np.ndarray"
+    currBalance: float
+
+@dataclass
+class ScenarioResult:
+    labels: list[str]
+    start: date  # last day of the known history, scenarios begin the day after
+    end: date
+    total_interest: "np.ndarray"  # (scenarios, borrowers) interest charged or accrued after start
+    payoff: "np.ndarray"  # (scenarios, borrowers) day ordinal of the payment clearing the balance, 0 if not by end
+    final_balance: "np.ndarray"  # (scenarios, borrowers) balance at end including accrued interest
+
+@dataclass
+class InterestAllocation:
+    labels: list[str]
+    charge_days: "np.ndarray"  # (charges,) day ordinals the bank posted interest on
+    charges: "np.ndarray"  # (charges,) cents the bank charged
+    allocated: "np.ndarray"  # (charges, borrowers) cents allocated to each borrower
+    unallocated: "np.ndarray"  # (charges,) cents charged while no borrower owed anything
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[..., Any]  # called with the results of deps, in order
+    deps: list[str] = field(default_factory=list)
+    process: bool = False  # CPU bound, run in a process pool (func and its results must pickle)
@@ -0,0 +1,200 @@
+import json
+import os
+from datetime import date
+from typing import Iterable, Iterator, List, Tuple
+import numpy as np
+import lib.definitions as d
+import lib.trace as trace
+import lib.utils as u
+
+EXPORT_FORMATS = ("csv", "npz")
+WRITE_BUFFER = 1 << 20
+
+ACCOUNT_HEADER = "date,type,description,amount,balance"
+RATES_HEADER = "start_date,end_date,interest_rate"
+DAILY_HEADER = "date,rate,balance,daily_interest,accrued,cumulative_interest"
+SUMMARY_FILE = "summary.json"
+
+def _replace_atomically(full_path: str, write) -> None:
+    # readers never see a half written file, an interrupted export leaves the old one
+    tmp_path = full_path + ".tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, full_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _write_lines(full_path: str, header: str, lines: Iterable[str]) -> None:
+    def write(tmp_path: str) -> None:
+        with open(tmp_path, "w", encoding="utf-8", buffering=WRITE_BUFFER) as f:
+            f.write(header + "\n")
+            f.writelines(line + "\n" for line in lines)
+    _replace_atomically(full_path, write)
+
+def write_npz(full_path: str, **columns: np.ndarray) -> None:
+    """
+    Writes named columns to a .npz file, replacing any previous file atomically.
+    """
+    def write(tmp_path: str) -> None:
+        # np.savez appends .npz to names without it, so hand it an open file
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **columns)
+    _replace_atomically(full_path, write)
+
+def text_column(values: List[str | None]) -> np.ndarray:
+    """
+    Turns strings into a fixed width unicode column, None as "", so the file loads without pickle.
+    """
+    return np.array(["" if v is None else v for v in values], dtype=str)
+
+def write_account(full_path: str, account: d.Account, format: str = "csv") -> int:
+    """
+    Writes an account ledger as CSV or as a columnar .npz file.
+
+    The .npz columns are date (day ordinals), type, description, amount_cents and balance_cents.
+
+    Returns:
+        int: Number of rows written
+    """
+    rows = account.rows
+    with trace.span("write_account", file=os.path.basename(full_path), rows=len(rows)):
+        if format == "csv":
+            _write_lines(full_path, ACCOUNT_HEADER, rows.toCSV())
+        elif format == "npz":
+            write_npz(
+                full_path,
+                date=np.frombuffer(rows.dates, dtype=np.int32),
+                type=text_column(rows.types),
+                description=text_column(rows.descriptions),
+                amount_cents=np.frombuffer(rows.amount_cents, dtype=np.int64),
+                balance_cents=np.frombuffer(rows.balance_cents, dtype=np.int64)
+            )
+        else:
+            raise ValueError(f"Unsupported export format {format}, expected one of {', '.join(EXPORT_FORMATS)}")
+    return len(rows)
+
+def write_rates(full_path: str, rates: List[d.InterestSummary], format: str = "csv") -> int:
+    """
+    Writes interest rates as CSV or as a columnar .npz file.
+
+    The .npz columns are start and end (day ordinals) and rate.
+
+    Returns:
+        int: Number of rows written
+    """
+    if format == "csv":
+        _write_lines(full_path, RATES_HEADER, (rate.toCSV() for rate in rates))
+    elif format == "npz":
+        write_npz(
+            full_path,
+            start=np.array([rate.start.toordinal() for rate in rates], dtype=np.int32),
+            end=np.array([rate.end.toordinal() for rate in rates], dtype=np.int32),
+            rate=np.array([rate.rate for rate in rates], dtype=float)
+        )
+    else:
+        raise ValueError(f"Unsupported export format {format}, expected one of {', '.join(EXPORT_FORMATS)}")
+    return len(rates)
+
+def write_daily_ledger(full_path: str, days: Iterable[Tuple[int, float, float, float, float, float]]) -> int:
+    """
+    Streams a daily ledger (iter_daily_interest) to CSV as it is computed, one day per line,
+    so only the write buffer is held in memory however many days there are.
+
+    Returns:
+        int: Number of days written
+    """
+    written = 0
+
+    def lines() -> Iterator[str]:
+        nonlocal written
+        for ordinal, rate, balance, daily, accrued, cumulative in days:
+            written += 1
+            yield f"{date.fromordinal(ordinal)},{rate},{balance:.2f},{daily:.6f},{accrued:.6f},{cumulative:.6f}"
+
+    with trace.span("write_daily_ledger", file=os.path.basename(full_path)):
+        _write_lines(full_path, DAILY_HEADER, lines())
+    return written
+
+def export_ledgers(
+    account: d.Account | None,
+    raw_rates: List[d.InterestSummary] | None,
+    rates: List[d.InterestSummary] | None,
+    interest_accounts: List[d.Account],
+    format: str = "csv",
+    data_path: str | None = None
+) -> List[str]:
+    """
+    Writes every result file of a run in one pass: account, raw_rates, rates and one
+    interest_<label> file per borrower, with their totals in summary.json. Anything passed
+    as None is skipped.
+
+    Args:
+        account (d.Account | None): Parsed account history
+        raw_rates (List[d.InterestSummary] | None): Rates as extracted from the statements
+        rates (List[d.InterestSummary] | None): Collapsed rates
+        interest_accounts (List[d.Account]): Interest ledger of each borrower
+        format (str): "csv" or the columnar "npz"
+        data_path (str | None): Output folder, defaults to src/data
+
+    Returns:
+        List[str]: Paths of the files written
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format {format}, expected one of {', '.join(EXPORT_FORMATS)}")
+
+    data_path = u.get_data_path(data_path)
+    written: List[str] = []
+    entries = 0
+
+    def path(name: str) -> str:
+        full_path = os.path.join(data_path, f"{name}.{format}")
+        written.append(full_path)
+        return full_path
+
+    if account is not None:
+        entries += write_account(path("account"), account, format)
+    if raw_rates is not None:
+        entries += write_rates(path("raw_rates"), raw_rates, format)
+    if rates is not None:
+        entries += write_rates(path("rates"), rates, format)
+    for interest_account in interest_accounts:
+        entries += write_account(path(f"interest_{interest_account.label}"), interest_account, format)
+    if interest_accounts:
+        summary_path = os.path.join(data_path, SUMMARY_FILE)
+        write_summary(summary_path, interest_accounts)
+        written.append(summary_path)
+
+    print(f"Exported {entries} entries in {len(written)} files to {data_path}")
+
+    return written
+
+def write_summary(full_path: str, interest_accounts: List[d.Account]) -> None:
+    """
+    Writes the totals of every borrower as the run computed them, unrounded, so a summary
+    read back later matches the one the run printed.
+    """
+    def write(tmp_path: str) -> None:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                a.label: {"principle": a.totalPrinciple, "interest": a.totalInterest, "balance": a.currBalance}
+                for a in interest_accounts
+            }, f, indent=2)
+    _replace_atomically(full_path, write)
+
+def load_summary(full_path: str) -> dict[str, tuple[float, float, float]]:
+    """
+    Loads the totals written by write_summary, (principle, interest, balance) by label,
+    or nothing if there is no summary.
+    """
+    if not os.path.exists(full_path):
+        return {}
+    with open(full_path, "r", encoding="utf-8") as f:
+        return {label: (t["principle"], t["interest"], t["balance"]) for label, t in json.load(f).items()}
+
+def load_columns(full_path: str) -> dict[str, np.ndarray]:
+    """
+    Loads a columnar .npz export into a dict of column name to array.
+    """
+    with np.load(full_path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
@@ -0,0 +1,89 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List
+import lib.definitions as d
+import lib.trace as trace
+
+def _check_graph(stages: List[d.Stage]) -> None:
+    """
+    Raises:
+        ValueError if a stage name is repeated, a dependency is unknown or the stages form a cycle.
+    """
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate stage names in {', '.join(names)}")
+    for stage in stages:
+        unknown = [dep for dep in stage.deps if dep not in names]
+        if unknown:
+            raise ValueError(f"Stage {stage.name} depends on unknown stage {', '.join(unknown)}")
+
+    done: set[str] = set()
+    while len(done) < len(stages):
+        ready = [stage.name for stage in stages if stage.name not in done and all(dep in done for dep in stage.deps)]
+        if not ready:
+            raise ValueError(f"Stages {', '.join(n for n in names if n not in done)} depend on each other")
+        done.update(ready)
+
+def run_stages(stages: List[d.Stage], workers: int = 1) -> Dict[str, Any]:
+    """
+    Runs a graph of stages, each as soon as the stages it depends on are done.
+
+    With workers > 1 up to that many stages run at once: I/O bound stages on a thread pool
+    and process stages on a process pool, so the run takes as long as its longest chain of
+    dependent stages rather than the sum of all of them. Otherwise the stages run one after
+    another, in the given order where dependencies allow.
+
+    The first stage to fail stops the run: stages not started yet are cancelled and its
+    error is raised once the running ones are done.
+
+    Args:
+        stages (List[d.Stage]): The stages, each called with the results of its deps
+        workers (int): Stages run at once
+
+    Returns:
+        Dict[str, Any]: The result of every stage, by name
+
+    Raises:
+        ValueError if the stages do not form a graph, see _check_graph
+    """
+    _check_graph(stages)
+    results: Dict[str, Any] = {}
+
+    if workers <= 1:
+        pending = list(stages)
+        while pending:
+            stage = next(s for s in pending if all(dep in results for dep in s.deps))
+            pending.remove(stage)
+            results[stage.name] = stage.func(*(results[dep] for dep in stage.deps))
+        return results
+
+    n_process = min(workers, sum(stage.process for stage in stages))
+    threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stage")
+    processes = ProcessPoolExecutor(max_workers=n_process, initializer=trace.init_worker, initargs=(trace.is_enabled(),)) if n_process else None
+    running: Dict[Future, d.Stage] = {}
+    pending = list(stages)
+
+    try:
+        while pending or running:
+            for stage in [s for s in pending if all(dep in results for dep in s.deps)]:
+                pending.remove(stage)
+                args = [results[dep] for dep in stage.deps]
+                if stage.process and processes is not None:
+                    running[processes.submit(trace.run_in_worker, stage.name, {}, stage.func, *args)] = stage
+                else:
+                    running[threads.submit(stage.func, *args)] = stage
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                if stage.process:
+                    # the stage's span and its sub-spans were recorded in the worker
+                    results[stage.name], spans = future.result()
+                    trace.replay(spans)
+                else:
+                    results[stage.name] = future.result()
+    finally:
+        threads.shutdown(cancel_futures=True)
+        if processes is not None:
+            processes.shutdown(cancel_futures=True)
+
+    return results
@@ -1,10 +1,18 @@
 import re
 import os
-from datetime import datetime, timedelta
-from typing import List
-import fitz  # PyMuPDF
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List
 import lib.definitions as d
-import lib.accounts as a
+import lib.trace as trace
+import lib.utils as u
+
+if TYPE_CHECKING:
+    from lib.schedule import RateSchedule
+    from lib.store import LedgerStore
 
 def parse_statements(folder_path: str) -> List[d.StatementSummary]:
     """
@@ -38,22 +46,57 @@ def parse_statements(folder_path: str) -> List[d.StatementSummary]:
 
     return statements
 
+# Entries like 15APRTO14MAY:5.250% once whitespace is removed and the text uppercased
+rate_pattern = re.compile(r'(\d{1,2}[A-Z]{3})TO(\d{1,2}[A-Z]{3}):([\d.]+)%')
+# Headings that open the section of a statement holding the interest summary
+section_pattern = re.compile(r'LINEOFCREDITDETAILS|INTERESTSUMMARY')
+# Tail of each page carried into the next, long enough to hold an entry split by a page break
+PAGE_CARRY = 32
+
+def _find_rate_matches(pages: Iterable[str]) -> list[tuple[str, str, str]]:
+    """
+    Scans the text of a statement page by page for interest summary entries.
+
+    Once the interest summary section has been reached and has produced entries, the scan
+    stops at the first page without more, so the pages after it are never read. Statements
+    in which no section heading is found are scanned in full.
+
+    Returns:
+        list[tuple[str, str, str]]: (start, end, rate) of every entry, in document order
+    """
+    matches: list[tuple[str, str, str]] = []
+    in_section = False
+    carry = ""
+
+    for text in pages:
+        cleaned = carry + re.sub(r'\s+', '', text.upper())  # All uppercase, no whitespace
+        in_section = in_section or section_pattern.search(cleaned) is not None
+
+        found = 0
+        last_end = 0
+        for match in rate_pattern.finditer(cleaned):
+            matches.append(match.groups())  # type: ignore
+            found += 1
+            last_end = match.end()
+
+        if in_section and matches and not found:
+            break
+        # an entry split by the page break is completed by the next page
+        carry = cleaned[last_end:][-PAGE_CARRY:]
+
+    return matches
+
 def _extract_rates(statement: d.StatementSummary) -> list[d.InterestSummary]:
     """
     Extracts all interest summary entries (start date, end date, rate) from a statement PDF.
 
     Returns a list of InterestSummary objects.
     """
-    with fitz.open(statement.path) as doc:
-        text = ""
-        for page in doc:
-            text += page.get_text()  # type: ignore
-
-    # Normalize the text
-    cleaned = re.sub(r'\s+', '', text.upper())  # All uppercase, no whitespace
+    import fitz  # PyMuPDF, imported here since it is slow to load and only needed for PDFs
 
-    # Find all matches like 15APRTO14MAY:5.250%
-    matches = re.findall(r'(\d{1,2}[A-Z]{3})TO(\d{1,2}[A-Z]{3}):([\d.]+)%', cleaned)
+    with fitz.open(statement.path) as doc:
+        # pages are only turned into text as the scan reaches them
+        matches = _find_rate_matches(page.get_text() for page in doc)  # type: ignore
 
     if not matches:
         raise ValueError(f"Failed to find any interest rates for {statement.date.strftime('%Y-%m')}")
@@ -87,7 +130,7 @@ def _extract_rates(statement: d.StatementSummary) -> list[d.InterestSummary]:
 
     return summaries
 
-def _collapse_rates(rates: List[d.InterestSummary]) -> List[d.InterestSummary]:
+def collapse_rates(rates: List[d.InterestSummary]) -> List[d.InterestSummary]:
     if not rates:
         return []
 
@@ -123,26 +166,337 @@ def _collapse_rates(rates: List[d.InterestSummary]) -> List[d.InterestSummary]:
     return collapsed
     
 
-def get_rates(statements: List[d.StatementSummary]) -> list[d.InterestSummary]:
+RATE_CACHE_VERSION = 1
+
+def _default_cache_path() -> str:
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(root_dir, "data", "cache", "rates.json")
+
+def _load_rate_cache(cache_path: str) -> Dict[str, Any]:
+    """
+    Loads the rate cache, starting over if it is missing, unreadable or from another version.
+    """
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if cache.get("version") != RATE_CACHE_VERSION:
+        return {}
+
+    return cache.get("statements", {})
+
+def _save_rate_cache(cache_path: str, entries: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+    # write to a temp file first so an interrupted run never leaves a broken cache
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": RATE_CACHE_VERSION, "statements": entries}, f)
+    os.replace(tmp_path, cache_path)
+
+def clear_rate_cache(cache_path: str | None = None) -> None:
+    """
+    Deletes the persistent rate cache so every statement is parsed again on the next run.
+    """
+    cache_path = cache_path or _default_cache_path()
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+        print(f"Cleared rate cache {cache_path}")
+
+def fingerprint_statements(statements: List[d.StatementSummary]) -> str:
+    """
+    Returns a hash of the statement files (path, size and mtime) and the parser version,
+    which changes whenever the rates extracted from them could.
+    """
+    digest = hashlib.sha256(str(RATE_CACHE_VERSION).encode("utf-8"))
+    for statement in statements:
+        stat = os.stat(statement.path)
+        digest.update(f"{os.path.abspath(statement.path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def _lookup_cached_rates(statement: d.StatementSummary, entries: Dict[str, Any]) -> list[d.InterestSummary] | None:
+    """
+    Returns the cached rates for a statement when its fingerprint still matches, otherwise None.
+
+    A statement is a hit when its size and mtime are unchanged. If either changed, the
+    content hash decides, so a copied or touched statement is not parsed again.
+    """
+    key = os.path.abspath(statement.path)
+    stat = os.stat(statement.path)
+    entry = entries.get(key)
+
+    if entry is None:
+        return None
+
+    if entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+        if entry["sha256"] != u.hash_file(statement.path):
+            return None
+        entry["size"] = stat.st_size
+        entry["mtime_ns"] = stat.st_mtime_ns
+
+    return [
+        d.InterestSummary(
+            start=datetime.strptime(start, "%Y-%m-%d"),
+            end=datetime.strptime(end, "%Y-%m-%d"),
+            rate=rate
+        )
+        for start, end, rate in entry["rates"]
+    ]
+
+def _store_cached_rates(statement: d.StatementSummary, entries: Dict[str, Any], rates: list[d.InterestSummary]) -> None:
+    stat = os.stat(statement.path)
+    entries[os.path.abspath(statement.path)] = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": u.hash_file(statement.path),
+        "rates": [
+            [r.start.strftime("%Y-%m-%d"), r.end.strftime("%Y-%m-%d"), r.rate]
+            for r in rates
+        ]
+    }
+
+def _extract_all_rates(
+    statements: List[d.StatementSummary],
+    workers: int = 1,
+    errors: Dict[str, str] | None = None
+) -> list[list[d.InterestSummary] | None]:
+    """
+    Extracts the rates of every statement, fanning them out to a process pool when workers > 1.
+
+    Results are returned in statement order. Every statement is attempted, and a single
+    error naming each file that failed is raised at the end. With errors, nothing is raised:
+    the error of each statement that failed is recorded there by its path, and its result
+    is None.
+    """
+    results: list[list[d.InterestSummary] | None] = [None] * len(statements)
+    failed: Dict[str, str] = {}
+
+    if workers > 1 and len(statements) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=trace.init_worker, initargs=(trace.is_enabled(),)) as pool:
+            futures = [
+                pool.submit(trace.run_in_worker, "extract_rates", {"statement": os.path.basename(s.path)}, _extract_rates, s)
+                for s in statements
+            ]
+            for idx, future in enumerate(futures):
+                try:
+                    results[idx], spans = future.result()
+                    trace.replay(spans)
+                except Exception as e:
+                    failed[statements[idx].path] = str(e)
+    else:
+        for idx, s in enumerate(statements):
+            try:
+                with trace.span("extract_rates", statement=os.path.basename(s.path)):
+                    results[idx] = _extract_rates(s)
+            except Exception as e:
+                failed[s.path] = str(e)
+
+    if errors is not None:
+        errors.update(failed)
+    elif failed:
+        raise ValueError("Failed to extract rates from " + "; ".join(f"{os.path.basename(path)}: {error}" for path, error in failed.items()))
+
+    return results
+
+def get_statement_rates(
+    statements: List[d.StatementSummary],
+    use_cache: bool = True,
+    cache_path: str | None = None,
+    workers: int = 1,
+    store: "LedgerStore | None" = None,
+    errors: Dict[str, str] | None = None
+) -> list[list[d.InterestSummary]]:
+    """
+    Extracts the interest rates of each statement, see get_raw_rates.
+
+    With errors, a statement that fails is recorded there by its path instead of raising,
+    gets no rates and is left out of the cache, so the others are still returned and kept.
+
+    Returns:
+        list[list[d.InterestSummary]]: The rates of every statement, in statement order
+    """
+    per_statement: list[list[d.InterestSummary] | None] = [None] * len(statements)
+
+    entries: Dict[str, Any] = {}
+    if store is not None:
+        # the store takes the place of the rate cache
+        per_statement = [store.cached_rates(s) for s in statements]
+    elif use_cache:
+        cache_path = cache_path or _default_cache_path()
+        entries = _load_rate_cache(cache_path)
+        for idx, s in enumerate(statements):
+            per_statement[idx] = _lookup_cached_rates(s, entries)
+
+    # Parse whatever the cache could not answer
+    missing = [idx for idx, rates in enumerate(per_statement) if rates is None]
+    extracted = _extract_all_rates([statements[idx] for idx in missing], workers, errors)
+    for idx, rates in zip(missing, extracted):
+        per_statement[idx] = rates
+
+    if store is not None:
+        for idx, rates in zip(missing, extracted):
+            if rates is not None:
+                store.put_rates(statements[idx], rates)
+        print(f"Parsed {len(missing)} statements, {len(statements) - len(missing)} loaded from the store")
+    elif use_cache and cache_path is not None:
+        for idx, rates in zip(missing, extracted):
+            if rates is not None:
+                _store_cached_rates(statements[idx], entries, rates)
+
+        # forget statements that were removed from disk
+        entries = {path: entry for path, entry in entries.items() if os.path.exists(path)}
+        _save_rate_cache(cache_path, entries)
+        print(f"Parsed {len(missing)} statements, {len(statements) - len(missing)} loaded from cache")
+
+    return [rates or [] for rates in per_statement]
+
+def get_raw_rates(
+    statements: List[d.StatementSummary],
+    use_cache: bool = True,
+    cache_path: str | None = None,
+    workers: int = 1,
+    store: "LedgerStore | None" = None
+) -> list[d.InterestSummary]:
+    """
+    Extracts the interest rates of all statements, in statement order.
+
+    Args:
+        statements (List[d.StatementSummary]): Statements sorted by date
+        use_cache (bool): Reuse rates of statements parsed on a previous run
+        cache_path (str | None): Location of the rate cache, defaults to data/cache/rates.json
+        workers (int): Number of processes used to parse statements, 1 parses them in this process
+        store (LedgerStore | None): Read and keep rates in this store instead of the rate cache
+    """
+    # Merge in statement order
     raw_rates: List[d.InterestSummary] = list()
-    for s in statements:
-        rates = _extract_rates(s)
+    for rates in get_statement_rates(statements, use_cache, cache_path, workers, store):
         for r in rates:
             raw_rates.append(r)
-            
-    export_csv("raw_rates.csv", raw_rates)
+
+    return raw_rates
+
+def statements_in_range(statements: List[d.StatementSummary], start: date, end: date) -> List[d.StatementSummary]:
+    """
+    Picks the statements whose periods can overlap start through end, using the dates in
+    their file names as a sorted index: every statement dated in the window, the last one
+    dated before it and the first one dated after it, since a statement covers days on both
+    sides of its date.
+
+    Args:
+        statements (List[d.StatementSummary]): Statements sorted by date (parse_statements)
+    """
+    dates = [s.date.date() for s in statements]
+    lo = max(bisect_right(dates, start) - 1, 0)
+    hi = bisect_right(dates, end) + 1
+    return statements[lo:hi]
+
+def check_coverage(raw_rates: List[d.InterestSummary], start: date, end: date) -> None:
+    """
+    Checks that the rates cover every day from start through end without gaps. Days before
+    the first or after the last rate are left out, the interest warns about those.
+
+    Raises:
+        ValueError if a stretch of days in between has no rate, e.g. a missing statement
+    """
+    from lib.schedule import RateSchedule
+
+    schedule = RateSchedule(raw_rates)
+    if not len(schedule):
+        return
+    first = max(start, date.fromordinal(int(schedule.starts[0])))
+    last = min(end, date.fromordinal(int(schedule.ends[-1])))
+    gaps = schedule.gaps(first, last) if first <= last else []
+    if gaps:
+        raise ValueError(f"No statement covers {', '.join(f'{a} to {b}' for a, b in gaps)}")
+
+def select_rates_in_range(
+    statements: List[d.StatementSummary],
+    start: date,
+    end: date,
+    fetch: Callable[[List[d.StatementSummary]], list[d.InterestSummary]]
+) -> tuple[List[d.StatementSummary], list[d.InterestSummary]]:
+    """
+    Picks the statements needed from start through end (statements_in_range) and gets their
+    rates with fetch. If the rates start after start, the file name dates were off, so
+    older statements are added until start is covered or none are left.
+
+    Args:
+        statements (List[d.StatementSummary]): Statements sorted by date (parse_statements)
+        fetch (Callable): Returns the rates of the statements given, in statement order
+
+    Returns:
+        tuple[List[d.StatementSummary], list[d.InterestSummary]]: The statements used and
+        their rates, in statement order
+    """
+    selected = statements_in_range(statements, start, end)
+    raw_rates = fetch(selected)
+
+    # The others are assumed off by as much as the first selected one, so every older
+    # statement needed is picked at once and they are fetched together.
+    earlier = statements[:statements.index(selected[0])] if selected else []
+    while earlier and (not raw_rates or min(r.start for r in raw_rates).date() > start):
+        first = min(r.start for r in raw_rates).date() if raw_rates else start
+        offset = selected[0].date.date() - first
+        k = max(bisect_right([s.date.date() for s in earlier], start + offset) - 1, 0)
+        added, earlier = earlier[k:], earlier[:k]
+        selected[:0] = added
+        raw_rates = fetch(added) + raw_rates
+
+    return selected, raw_rates
+
+def get_raw_rates_in_range(
+    statements: List[d.StatementSummary],
+    start: date,
+    end: date,
+    use_cache: bool = True,
+    cache_path: str | None = None,
+    workers: int = 1,
+    store: "LedgerStore | None" = None
+) -> list[d.InterestSummary]:
+    """
+    Extracts the interest rates needed from start through end, see get_raw_rates, opening
+    only the statements picked by select_rates_in_range.
+
+    Raises:
+        ValueError if the rates leave a gap in the window, see check_coverage
+    """
+    selected, raw_rates = select_rates_in_range(
+        statements, start, end,
+        lambda picked: get_raw_rates(picked, use_cache, cache_path, workers, store)
+    )
+    print(f"Using {len(selected)} of {len(statements)} statements for {start} to {end}")
+    check_coverage(raw_rates, start, end)
+    return raw_rates
+
+def get_rates(
+    statements: List[d.StatementSummary],
+    use_cache: bool = True,
+    cache_path: str | None = None,
+    workers: int = 1
+) -> list[d.InterestSummary]:
+    """
+    Extracts and collapses the interest rates of all statements, see get_raw_rates.
+    """
+    raw_rates = get_raw_rates(statements, use_cache, cache_path, workers)
     
-    collapsed_rates = _collapse_rates(raw_rates)
+    collapsed_rates = collapse_rates(raw_rates)
         
     return collapsed_rates
 
-def get_rate(date: datetime, rates: List[d.InterestSummary]) -> float:
+def get_rate(date: datetime, rates: "List[d.InterestSummary] | RateSchedule") -> float:
     """
-    Performs binary search on sorted InterestSummary list to find the rate for the given date.
+    Finds the rate for the given date. A RateSchedule is searched with RateSchedule.rate_at,
+    a list (sorted and not overlapping, see collapse_rates) with a binary search in place, so
+    neither builds anything per call. Callers looking up many dates should pass a RateSchedule.
 
     Raises:
         ValueError if the date does not fall within any interest range.
     """
+    if not isinstance(rates, list):
+        return rates.rate_at(date)
+
     left = 0
     right = len(rates) - 1
 
@@ -162,21 +516,15 @@ def get_rate(date: datetime, rates: List[d.InterestSummary]) -> float:
 def export_csv(file: str, rates: List[d.InterestSummary]) -> None:
     """
     Exports the list of InterestSummary entries to a CSV file in the /data directory.
+    Use export.export_ledgers to write all results of a run at once.
 
     Args:
         file (str): File name (e.g. 'july_rates.csv')
         rates (List[d.InterestSummary]): List of interest rate summaries
     """
-    # Determine full path
-    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    data_path = os.path.join(root_dir, "data")
-    os.makedirs(data_path, exist_ok=True)
-
-    full_path = os.path.join(data_path, file)
+    import lib.export as e
 
-    with open(full_path, "w", encoding="utf-8") as f:
-        f.write("start_date,end_date,interest_rate\n")
-        for rate in rates:
-            f.write(rate.toCSV() + "\n")
+    full_path = os.path.join(u.get_data_path(), file)
+    e.write_rates(full_path, rates)
 
-    print(f"Exported {len(rates)} entries to {full_path}")    
\ No newline at end of file
+    print(f"Exported {len(rates)} entries to {full_path}")
@@ -0,0 +1,123 @@
+import re
+from datetime import date
+from typing import List, Tuple
+import numpy as np
+import lib.definitions as d
+
+# Bank rows of these types are interest charged on the line of credit
+interest_type_pattern = re.compile(r'\binterest\b', re.IGNORECASE)
+
+def sum_by_day(days: np.ndarray, amounts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the sorted distinct days and the total amount on each.
+    """
+    unique, inverse = np.unique(days, return_inverse=True)
+    return unique, np.bincount(inverse, weights=amounts, minlength=len(unique)).astype(np.int64)
+
+def _cumulative_at(days: np.ndarray, amounts: np.ndarray, at: np.ndarray) -> np.ndarray:
+    """
+    Returns the running total of amounts (on sorted days) at the end of each day in at.
+    """
+    running = np.concatenate(([0], np.cumsum(amounts)))
+    return running[np.searchsorted(days, at, side="right")]
+
+def reconcile_interest(
+    account: d.Account,
+    interest_accounts: List[d.Account],
+    max_lag_days: int = 3,
+    tolerance: float = 0.01
+) -> d.ReconciliationReport:
+    """
+    Checks the interest computed for the borrowers against the interest the bank charged.
+
+    Computed charges of all borrowers are summed per charge day. Bank interest rows posted
+    up to max_lag_days after a charge day count towards that day, and both series are then
+    merged on day ordinals and compared in one pass. The bank balance is followed too: since
+    every loan row was matched to a bank transaction, the borrowers' balances only drift
+    from the bank's through interest or a bank balance that does not add up, and the first
+    day that happens is found by binary search over the running count of drifted days.
+
+    Only days from the first borrower transaction to the last bank transaction are compared.
+
+    Args:
+        account (d.Account): Parsed account history (parse_csv)
+        interest_accounts (List[d.Account]): Interest ledger of every borrower
+        max_lag_days (int): Days the bank may take to post a charge
+        tolerance (float): Differences up to this many dollars are ignored
+
+    Returns:
+        d.ReconciliationReport: Totals, the charge days that differ and the first divergent day
+    """
+    tolerance_cents = int(round(tolerance * 100))
+    bank_days, bank_amounts, bank_balances = account.rows.columns()
+    bank_interest = np.fromiter(
+        (interest_type_pattern.search(t or "") is not None for t in account.rows.types),
+        dtype=bool, count=len(account.rows)
+    )
+
+    # All borrower ledgers as one
+    ledgers = [a.rows.columns() for a in interest_accounts if len(a.rows)]
+    if not ledgers or not len(bank_days):
+        return d.ReconciliationReport(0, 0.0, 0.0, [], None, 0.0)
+    loan_days = np.concatenate([days for days, _, _ in ledgers])
+    loan_amounts = np.concatenate([amounts for _, amounts, _ in ledgers])
+    loan_interest = np.concatenate([np.array([t == "interest" for t in a.rows.types], dtype=bool) for a in interest_accounts if len(a.rows)])
+
+    first = int(loan_days.min())
+    last = int(bank_days[-1])
+
+    # Computed interest per charge day
+    charge_days, computed = sum_by_day(loan_days[loan_interest], loan_amounts[loan_interest])
+
+    # Bank interest moved back onto the charge day it belongs to
+    posted_days = bank_days[bank_interest]
+    charged_days = posted_days
+    if len(charge_days):
+        idx = np.searchsorted(charge_days, posted_days, side="right") - 1
+        prior = charge_days[np.maximum(idx, 0)]
+        charged_days = np.where((idx >= 0) & (posted_days - prior <= max_lag_days), prior, posted_days)
+    bank_charge_days, charged = sum_by_day(charged_days, bank_amounts[bank_interest])
+
+    # Sorted merge of both series
+    days = np.union1d(charge_days, bank_charge_days)
+    days = days[(days >= first) & (days <= last)]
+    bank_per_day = np.zeros(len(days), dtype=np.int64)
+    computed_per_day = np.zeros(len(days), dtype=np.int64)
+    keep = (bank_charge_days >= first) & (bank_charge_days <= last)
+    bank_per_day[np.searchsorted(days, bank_charge_days[keep])] = charged[keep]
+    keep = (charge_days >= first) & (charge_days <= last)
+    computed_per_day[np.searchsorted(days, charge_days[keep])] = computed[keep]
+
+    differs = np.abs(bank_per_day - computed_per_day) > tolerance_cents
+    discrepancies = [
+        d.InterestDiscrepancy(date.fromordinal(int(day)), bank / 100, ours / 100)
+        for day, bank, ours in zip(days[differs], bank_per_day[differs], computed_per_day[differs])
+    ]
+
+    # Balance drift at the end of every day either ledger moves. Rows are newest first
+    # within a day, so the first row of each day holds its closing bank balance.
+    check_days = np.union1d(np.unique(bank_days), np.unique(loan_days))
+    check_days = check_days[(check_days >= first) & (check_days <= last)]
+    day_starts = np.flatnonzero(np.diff(bank_days, prepend=bank_days[0] - 1))
+    closing = bank_balances[day_starts]
+    opening = closing[0] - bank_amounts[bank_days == bank_days[0]].sum()
+    bank_closing = closing[np.maximum(np.searchsorted(bank_days[day_starts], check_days, side="right") - 1, 0)]
+
+    in_range = bank_charge_days >= first
+    drift = (
+        bank_closing - opening - _cumulative_at(bank_days, bank_amounts, check_days)  # bank balance that does not add up
+        + _cumulative_at(bank_charge_days[in_range], charged[in_range], check_days)
+        - _cumulative_at(charge_days, computed, check_days)
+    )
+    drifted = np.cumsum(np.abs(drift) > tolerance_cents)
+    k = int(np.searchsorted(drifted, 1))
+    first_divergence = date.fromordinal(int(check_days[k])) if k < len(check_days) else None
+
+    return d.ReconciliationReport(
+        charge_days=len(days),
+        bank_interest=float(bank_per_day.sum()) / 100,
+        computed_interest=float(computed_per_day.sum()) / 100,
+        discrepancies=discrepancies,
+        first_divergence=first_divergence,
+        drift=float(drift[-1]) / 100 if len(drift) else 0.0
+    )
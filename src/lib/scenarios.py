@@ -0,0 +1,184 @@
+from datetime import date, timedelta
+from typing import List, Sequence
+import numpy as np
+import lib.definitions as defs
+import lib.utils as u
+from lib.interest import calculate_interest_rows, get_charge_days
+from lib.schedule import RateSchedule, as_schedule
+
+def step_rate_paths(base_rate: float, n_days: int, changes: np.ndarray, change_days: np.ndarray) -> np.ndarray:
+    """
+    Builds daily rate paths that start at base_rate and step by the given changes.
+
+    Args:
+        base_rate (float): Rate in effect before the first change, e.g. the last known rate
+        n_days (int): Length of the paths in days
+        changes (np.ndarray): (scenarios, steps) rate changes, e.g. 0.01 for a 1% hike
+        change_days (np.ndarray): (steps,) or (scenarios, steps) day offset each change takes effect
+
+    Returns:
+        np.ndarray: (scenarios, n_days) rate in effect on each day
+    """
+    changes = np.atleast_2d(np.asarray(changes, dtype=float))
+    change_days = np.broadcast_to(np.asarray(change_days, dtype=np.int64), changes.shape)
+
+    deltas = np.zeros((changes.shape[0], n_days + 1))
+    rows = np.broadcast_to(np.arange(changes.shape[0])[:, None], changes.shape)
+    np.add.at(deltas, (rows, np.clip(change_days, 0, n_days)), changes)
+    return np.maximum(base_rate + np.cumsum(deltas[:, :n_days], axis=1), 0)
+
+def random_rate_paths(
+    base_rate: float,
+    n_days: int,
+    n_scenarios: int,
+    change_every: int = 45,
+    step: float = 0.0025,
+    p_change: float = 0.3,
+    seed: int | None = None
+) -> np.ndarray:
+    """
+    Draws rate paths that may move by +/- step on every change_every-th day, like prime
+    rate decisions, each move happening with probability p_change.
+
+    Returns:
+        np.ndarray: (n_scenarios, n_days) rate in effect on each day
+    """
+    rng = np.random.default_rng(seed)
+    change_days = np.arange(change_every, n_days, change_every)
+    moves = rng.choice([-step, step], size=(n_scenarios, len(change_days)))
+    moves *= rng.random((n_scenarios, len(change_days))) < p_change
+    return step_rate_paths(base_rate, n_days, moves, change_days)
+
+def run_scenarios(
+    accounts: List[defs.Account],
+    interest_summaries: List[defs.InterestSummary] | RateSchedule,
+    end: date,
+    rate_paths: np.ndarray,
+    payments: np.ndarray | Sequence[float],
+    interest_day: int = 15,
+    payment_day: int | None = None
+) -> defs.ScenarioResult:
+    """
+    Projects the loans of every borrower from today to end under many scenarios at once.
+
+    The known history is computed as usual, then each scenario continues it with its own
+    daily rates and monthly payments. The state of all scenarios and borrowers is held in
+    (scenarios x borrowers) arrays and advanced from one payment or charge day to the next;
+    the accrual in between comes from running sums of the rate paths, so the cost grows with
+    the number of months, not days. Interest is computed in floats as calculate_interest_rows does.
+
+    Payments never pay more than is owed (balance plus accrued interest); negative amounts
+    are drawn as new loans.
+
+    Args:
+        accounts (List[defs.Account]): Loan accounts, one per borrower
+        interest_summaries (List[defs.InterestSummary] | RateSchedule): Known interest rates
+        end (date): Last day projected
+        rate_paths (np.ndarray): (days,) or (scenarios, days) annual rate on each day after today through end
+        payments (np.ndarray): Monthly payment of each borrower, as (borrowers,), (scenarios, borrowers)
+            or (scenarios, borrowers, months) with one entry per payment day through end
+        interest_day (int): Day of the month interest is charged on
+        payment_day (int | None): Day of the month payments are made, defaults to interest_day
+
+    Returns:
+        defs.ScenarioResult: Interest, payoff day and final balance per scenario and borrower
+    """
+    today = date.today()
+    origin = today.toordinal()
+    n_days = end.toordinal() - origin
+    if n_days <= 0:
+        raise ValueError(f"Scenario end {end} must be after today")
+
+    rate_paths = np.atleast_2d(np.asarray(rate_paths, dtype=float))
+    if rate_paths.shape[1] != n_days:
+        raise ValueError(f"Rate paths cover {rate_paths.shape[1]} days, expected {n_days} (the day after today through {end})")
+
+    payment_offsets = [d.toordinal() - origin - 1 for d in get_charge_days(today + timedelta(days=1), end, payment_day or interest_day)]
+    charge_offsets = [d.toordinal() - origin - 1 for d in get_charge_days(today + timedelta(days=1), end, interest_day)]
+
+    payments = np.asarray(payments, dtype=float)
+    if payments.ndim < 3:
+        payments = np.broadcast_to(np.atleast_2d(payments)[..., None], np.atleast_2d(payments).shape + (len(payment_offsets),))
+    if payments.shape[1] != len(accounts) or payments.shape[2] != len(payment_offsets):
+        raise ValueError(f"Payments have shape {payments.shape}, expected (scenarios, {len(accounts)}, {len(payment_offsets)})")
+
+    # Where every borrower stands today
+    schedule = as_schedule(interest_summaries)
+    balance0 = np.zeros(len(accounts))
+    accrued0 = np.zeros(len(accounts))
+    for b, account in enumerate(accounts):
+        _, index = calculate_interest_rows(account, schedule, interest_day, with_index=True)
+        balance0[b] = index.balance_at(today)
+        accrued0[b] = index.accrued_at(today)
+
+    n_scenarios = max(rate_paths.shape[0], payments.shape[0])
+    shape = (n_scenarios, len(accounts))
+    balance = np.broadcast_to(balance0, shape).copy()
+    accrued = np.broadcast_to(accrued0, shape).copy()
+    interest = np.zeros(shape)
+    payoff = np.where(balance + accrued >= -0.005, origin, 0)
+
+    # daily interest per dollar owed, summed from the first projected day
+    rate_sums = np.zeros((rate_paths.shape[0], n_days + 1))
+    np.cumsum(rate_paths / 365, axis=1, out=rate_sums[:, 1:])
+
+    def accrue(first: int, stop: int) -> None:
+        # days first..stop-1 at the current balance, positive balances earn nothing
+        accrued[:] += np.minimum(0, balance) * (rate_sums[:, stop] - rate_sums[:, first])[:, None]
+
+    cursor = 0
+    charges = set(charge_offsets)
+    months = {offset: m for m, offset in enumerate(payment_offsets)}
+    for day in sorted(charges | months.keys()):
+        if day in months:
+            # payments come before the day's accrual
+            accrue(cursor, day)
+            cursor = day
+            owed = np.maximum(0, -(balance + accrued))
+            amount = payments[:, :, months[day]]
+            paid = np.where(amount > 0, np.minimum(amount, owed), amount)
+            payoff[(payoff == 0) & (owed > 0) & (amount >= owed)] = origin + 1 + day
+            balance += paid
+
+        if day in charges:
+            accrue(cursor, day + 1)
+            cursor = day + 1
+            charged = np.abs(accrued) > 0.005  # threshold to avoid noise
+            interest += np.where(charged, accrued, 0)
+            balance += np.where(charged, accrued, 0)
+            accrued[charged] = 0
+
+    accrue(cursor, n_days)
+
+    return defs.ScenarioResult(
+        labels=[account.label for account in accounts],
+        start=today,
+        end=end,
+        total_interest=interest + accrued,
+        payoff=payoff,
+        final_balance=balance + accrued
+    )
+
+def summarize_scenarios(result: defs.ScenarioResult, percentiles: Sequence[float] = (5, 50, 95)) -> str:
+    """
+    Formats the distribution of total interest and payoff dates of every borrower as a table,
+    with the share of scenarios paid off by the end.
+    """
+    headers = ["Label"]
+    headers += [f"Interest p{p:g}" for p in percentiles]
+    headers += [f"Payoff p{p:g}" for p in percentiles]
+    headers.append("Paid Off")
+
+    rows: List[List[str]] = []
+    for b, label in enumerate(result.labels):
+        interest = np.percentile(result.total_interest[:, b], percentiles)
+        row = [label] + [u.format_currency(float(x)) for x in interest]
+
+        payoff = result.payoff[:, b]
+        # scenarios that never pay off sort last
+        days = np.percentile(np.where(payoff > 0, payoff, np.iinfo(np.int64).max), percentiles, method="higher")
+        row += [str(date.fromordinal(int(d))) if d != np.iinfo(np.int64).max else "-" for d in days]
+        row.append(f"{np.mean(payoff > 0):.0%}")
+        rows.append(row)
+
+    return u.format_table(headers, rows)
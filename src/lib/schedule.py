@@ -0,0 +1,158 @@
+import heapq
+from datetime import date, datetime
+from typing import Iterable, Iterator, List, Tuple
+import numpy as np
+import lib.definitions as d
+
+def _flatten(interest_summaries: List[d.InterestSummary]) -> List[Tuple[int, int, float]]:
+    """
+    Flattens the interest summaries into sorted, non-overlapping (start, end, rate) segments
+    with start and end as inclusive day ordinals.
+
+    Summaries are applied in start order, so a later summary overrides any days it
+    shares with an earlier one. The days are swept once from boundary to boundary with
+    a heap of the summaries in effect, the latest applied on top.
+    """
+    ordered = [
+        (summary.start.toordinal(), summary.end.toordinal(), summary.rate)
+        for summary in sorted(interest_summaries, key=lambda r: r.start)
+    ]
+    ordered = [(start, end, rate) for start, end, rate in ordered if end >= start]
+    points = sorted({start for start, _, _ in ordered} | {end + 1 for _, end, _ in ordered})
+
+    segments: List[Tuple[int, int, float]] = []
+    owners: List[int] = []
+    active: List[Tuple[int, int]] = []  # (-position, end), the latest applied first
+    nxt = 0
+    for point, following in zip(points, points[1:]):
+        while nxt < len(ordered) and ordered[nxt][0] <= point:
+            heapq.heappush(active, (-nxt, ordered[nxt][1]))
+            nxt += 1
+        while active and active[0][1] < point:
+            heapq.heappop(active)
+        if not active:
+            continue
+
+        # every end + 1 is a point, so the summary on top covers the whole stretch
+        owner = -active[0][0]
+        if owners and owners[-1] == owner and segments[-1][1] == point - 1:
+            segments[-1] = (segments[-1][0], following - 1, segments[-1][2])
+        else:
+            segments.append((point, following - 1, ordered[owner][2]))
+            owners.append(owner)
+
+    return segments
+
+def _to_datetime(ordinal: int) -> datetime:
+    return datetime.combine(date.fromordinal(ordinal), datetime.min.time())
+
+class RateSchedule:
+    """
+    Interval index over the interest rates in effect over time.
+
+    Stores the segment starts, ends (inclusive day ordinals) and rates in sorted arrays,
+    so single lookups are a binary search and batches of days are resolved at once.
+    """
+
+    def __init__(self, interest_summaries: List[d.InterestSummary]):
+        segments = _flatten(interest_summaries)
+        self.starts = np.array([s for s, _, _ in segments], dtype=np.int64)
+        self.ends = np.array([e for _, e, _ in segments], dtype=np.int64)
+        self.rates = np.array([r for _, _, r in segments], dtype=float)
+
+    def __len__(self) -> int:
+        return len(self.rates)
+
+    def __iter__(self) -> Iterator[d.InterestSummary]:
+        for start, end, rate in zip(self.starts, self.ends, self.rates):
+            yield d.InterestSummary(
+                start=_to_datetime(int(start)),
+                end=_to_datetime(int(end)),
+                rate=float(rate)
+            )
+
+    def find(self, day: date) -> int:
+        """
+        Returns the index of the segment covering the given day, or -1 if no rate applies.
+        """
+        ordinal = day.toordinal()
+        idx = int(np.searchsorted(self.starts, ordinal, side="right")) - 1
+        if idx >= 0 and ordinal <= self.ends[idx]:
+            return idx
+        return -1
+
+    def rate_at(self, day: date) -> float:
+        """
+        Returns the rate in effect on the given day.
+
+        Raises:
+            ValueError if the day does not fall within any interest range.
+        """
+        idx = self.find(day)
+        if idx < 0:
+            raise ValueError(f"No interest rate found for {date.fromordinal(day.toordinal())}")
+        return float(self.rates[idx])
+
+    def lookup(self, ordinals: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Resolves an array of day ordinals at once.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The rate for each day (0 where uncovered) and a
+            mask of which days are covered by the schedule
+        """
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        if len(self) == 0:
+            return np.zeros(ordinals.shape), np.zeros(ordinals.shape, dtype=bool)
+
+        idx = np.searchsorted(self.starts, ordinals, side="right") - 1
+        safe = np.clip(idx, 0, len(self) - 1)
+        covered = (idx >= 0) & (ordinals <= self.ends[safe])
+        return np.where(covered, self.rates[safe], 0.0), covered
+
+    def rates_for(self, days: Iterable[date] | np.ndarray) -> np.ndarray:
+        """
+        Returns the rate for each of the given days (dates or day ordinals), 0 where no rate applies.
+        """
+        if not isinstance(days, np.ndarray):
+            days = np.fromiter((day.toordinal() for day in days), dtype=np.int64)
+        return self.lookup(days)[0]
+
+    def boundaries(self) -> np.ndarray:
+        """
+        Returns the sorted day ordinals on which the rate in effect may change.
+        """
+        return np.union1d(self.starts, self.ends + 1)
+
+    def gaps(self, start: date, end: date) -> List[Tuple[date, date]]:
+        """
+        Reports the stretches between start and end (inclusive) that no rate covers.
+
+        Returns:
+            List[Tuple[date, date]]: Inclusive (first, last) day of every uncovered stretch
+        """
+        lo = start.toordinal()
+        hi = end.toordinal()
+        gaps: List[Tuple[date, date]] = []
+
+        # only the segments overlapping the window matter
+        first = int(np.searchsorted(self.ends, lo, side="left"))
+        last = int(np.searchsorted(self.starts, hi, side="right"))
+
+        cursor = lo
+        for s, e in zip(self.starts[first:last], self.ends[first:last]):
+            if s > cursor:
+                gaps.append((date.fromordinal(cursor), date.fromordinal(int(s) - 1)))
+            cursor = max(cursor, int(e) + 1)
+        if cursor <= hi:
+            gaps.append((date.fromordinal(cursor), date.fromordinal(hi)))
+
+        return gaps
+
+def as_schedule(interest_summaries: List[d.InterestSummary] | RateSchedule) -> RateSchedule:
+    """
+    Returns the given schedule, or builds one from a list of interest summaries.
+    """
+    if isinstance(interest_summaries, RateSchedule):
+        return interest_summaries
+    return RateSchedule(interest_summaries)
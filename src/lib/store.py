@@ -0,0 +1,254 @@
+import hashlib
+import os
+import sqlite3
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Sequence, Tuple
+import lib.definitions as d
+import lib.utils as u
+import lib.vancity as v
+
+STORE_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS statements (
+    path TEXT PRIMARY KEY,
+    date INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rates (
+    statement TEXT NOT NULL REFERENCES statements(path) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    rate REAL NOT NULL,
+    PRIMARY KEY (statement, seq)
+);
+CREATE INDEX IF NOT EXISTS rates_start ON rates(start);
+
+CREATE TABLE IF NOT EXISTS imports (
+    path TEXT PRIMARY KEY,
+    account TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    account TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    date INTEGER NOT NULL,
+    day_rank INTEGER NOT NULL,
+    type TEXT,
+    description TEXT,
+    amount_cents INTEGER NOT NULL,
+    balance_cents INTEGER NOT NULL,
+    PRIMARY KEY (account, fingerprint)
+);
+CREATE INDEX IF NOT EXISTS transactions_date ON transactions(account, date, day_rank);
+"""
+
+def _fingerprints(owner: str, rows: Iterable[Tuple]) -> List[str]:
+    """
+    Fingerprints rows by their content and how many identical rows came before them, so
+    a transaction seen again in a later export maps to the same key while two identical
+    transactions on the same day stay distinct.
+    """
+    seen: Counter[Tuple] = Counter()
+    fingerprints: List[str] = []
+    for row in rows:
+        occurrence = seen[row]
+        seen[row] += 1
+        key = "\x1f".join(str(field) for field in (owner, *row, occurrence))
+        fingerprints.append(hashlib.sha1(key.encode("utf-8")).hexdigest())
+    return fingerprints
+
+def _to_datetime(ordinal: int) -> datetime:
+    return datetime.fromordinal(ordinal)
+
+class LedgerStore:
+    """
+    Local SQLite store of statements and their rates and of bank transactions, indexed by
+    account and date.
+
+    Imports only add what is new: statements are keyed by path and fingerprinted like the
+    rate cache, and bank transactions by a fingerprint of their content, so overlapping
+    exports can be imported again and again.
+    """
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, STORE_VERSION):
+            raise ValueError(f"Store {path} has version {version}, expected {STORE_VERSION}")
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+            self.conn.execute(f"PRAGMA user_version = {STORE_VERSION}")
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "LedgerStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # Statements and rates
+
+    def cached_rates(self, statement: d.StatementSummary) -> List[d.InterestSummary] | None:
+        """
+        Returns the stored rates of a statement if the file is unchanged, otherwise None.
+        Like the rate cache, a changed size or mtime falls back to comparing content hashes.
+        """
+        key = os.path.abspath(statement.path)
+        entry = self.conn.execute("SELECT size, mtime_ns, sha256 FROM statements WHERE path = ?", (key,)).fetchone()
+        if entry is None:
+            return None
+
+        stat = os.stat(statement.path)
+        if (entry[0], entry[1]) != (stat.st_size, stat.st_mtime_ns):
+            if entry[2] != u.hash_file(statement.path):
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE statements SET size = ?, mtime_ns = ? WHERE path = ?", (stat.st_size, stat.st_mtime_ns, key))
+
+        return [
+            d.InterestSummary(start=_to_datetime(start), end=_to_datetime(end), rate=rate)
+            for start, end, rate in self.conn.execute("SELECT start, end, rate FROM rates WHERE statement = ? ORDER BY seq", (key,))
+        ]
+
+    def put_rates(self, statement: d.StatementSummary, rates: List[d.InterestSummary]) -> None:
+        """
+        Stores the rates extracted from a statement, replacing any it had.
+        """
+        key = os.path.abspath(statement.path)
+        stat = os.stat(statement.path)
+        with self.conn:
+            self.conn.execute("DELETE FROM statements WHERE path = ?", (key,))
+            self.conn.execute(
+                "INSERT INTO statements (path, date, size, mtime_ns, sha256) VALUES (?, ?, ?, ?, ?)",
+                (key, statement.date.toordinal(), stat.st_size, stat.st_mtime_ns, u.hash_file(statement.path))
+            )
+            self.conn.executemany(
+                "INSERT INTO rates (statement, seq, start, end, rate) VALUES (?, ?, ?, ?, ?)",
+                [(key, seq, r.start.toordinal(), r.end.toordinal(), r.rate) for seq, r in enumerate(rates)]
+            )
+
+    # Bank transactions
+
+    def imported_account(self, path: str) -> str | None:
+        """
+        Returns the account number of an export already imported unchanged, otherwise None.
+        """
+        stat = os.stat(path)
+        row = self.conn.execute(
+            "SELECT account FROM imports WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _day_ranks(self, account_number: str, dates: Sequence[int], fingerprints: List[str]) -> List[int]:
+        """
+        Returns the position within its day of every row of an export, continuing from the
+        rows already stored. Rows are newest first within a day as in the export, so on a day
+        that has stored rows, new rows the export lists before the first of them rank ahead
+        of every stored row and the others after them. Stored rows keep their rank.
+        """
+        stored: Dict[str, int] = {}
+        bounds: Dict[int, Tuple[int, int]] = {}
+        if len(dates):
+            window = (account_number, min(dates), max(dates))
+            stored = dict(self.conn.execute(
+                "SELECT fingerprint, day_rank FROM transactions WHERE account = ? AND date BETWEEN ? AND ?", window
+            ).fetchall())
+            bounds = {
+                day: (lo, hi) for day, lo, hi in self.conn.execute(
+                    "SELECT date, MIN(day_rank), MAX(day_rank) FROM transactions"
+                    " WHERE account = ? AND date BETWEEN ? AND ? GROUP BY date", window
+                )
+            }
+
+        ranks = [0] * len(dates)
+        start = 0
+        while start < len(dates):
+            end = start
+            while end < len(dates) and dates[end] == dates[start]:
+                end += 1
+            day = range(start, end)
+            if dates[start] not in bounds:
+                for rank, k in enumerate(day):
+                    ranks[k] = rank
+            else:
+                lo, hi = bounds[dates[start]]
+                newer = next((i for i, k in enumerate(day) if fingerprints[k] in stored), 0)
+                for i, k in enumerate(day[:newer]):
+                    ranks[k] = lo - newer + i
+                for i, k in enumerate(k for k in day[newer:] if fingerprints[k] not in stored):
+                    ranks[k] = hi + 1 + i
+            start = end
+        return ranks
+
+    def import_account(self, account: d.Account, path: str | None = None) -> int:
+        """
+        Adds the transactions of a parsed export (see vancity.parse_csv) that are not stored yet.
+
+        Args:
+            account (d.Account): The parsed export, labelled with its account number
+            path (str | None): The export file, remembered so it is not parsed again while unchanged
+
+        Returns:
+            int: Number of new transactions
+        """
+        rows = account.rows
+        keys = list(zip(rows.dates, rows.types, rows.descriptions, rows.amount_cents, rows.balance_cents))
+        fingerprints = _fingerprints(account.label, keys)
+
+        with self.conn:
+            ranks = self._day_ranks(account.label, rows.dates, fingerprints)
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO transactions (account, fingerprint, date, day_rank, type, description, amount_cents, balance_cents)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (account.label, fingerprint, day, rank, type, description, amount, balance)
+                    for fingerprint, rank, (day, type, description, amount, balance) in zip(fingerprints, ranks, keys)
+                ]
+            )
+            inserted = self.conn.total_changes - before
+            if path is not None:
+                stat = os.stat(path)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO imports (path, account, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                    (os.path.abspath(path), account.label, stat.st_size, stat.st_mtime_ns)
+                )
+        return inserted
+
+    def account(self, account_number: str) -> d.Account:
+        """
+        Returns the full stored history of a bank account, sorted by date like parse_csv.
+        """
+        rows = d.Ledger()
+        for day, type, description, amount, balance in self.conn.execute(
+            "SELECT date, type, description, amount_cents, balance_cents FROM transactions"
+            " WHERE account = ? ORDER BY date, day_rank",
+            (account_number,)
+        ):
+            rows.append_cents(day, type, description, amount, balance)
+
+        if not len(rows):
+            raise ValueError(f"No transactions stored for account {account_number}")
+
+        return d.Account(
+            label=account_number,
+            rows=rows,
+            currBalance=rows.balance_cents[v.closing_row(rows.dates)] / 100,
+            totalInterest=-1,
+            totalPrinciple=-1
+        )
@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, TextIO, TypeVar
+
+try:
+    import resource
+except ImportError:  # not available on Windows, memory is simply not reported
+    resource = None
+
+# Tracing is off unless enable() is called. While off, span() hands back one shared
+# no-op context manager, so instrumented code pays a single global lookup per span.
+_tracer: "_Tracer | None" = None
+_NULL_SPAN = nullcontext()
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+def _max_rss_kb() -> int | None:
+    if resource is None:
+        return None
+    # ru_maxrss is the peak resident set size of the process so far (KiB on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class _Tracer:
+    def __init__(self, jsonl_path: str | None, chrome_path: str | None, collect: bool = False):
+        self.jsonl: TextIO | None = open(jsonl_path, "w", encoding="utf-8", buffering=1) if jsonl_path else None
+        self.chrome_path = chrome_path
+        self.events: List[Dict[str, Any]] = []
+        # spans of a pool worker, kept for the parent (see drain)
+        self.collected: List[Dict[str, Any]] | None = [] if collect else None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def depth(self) -> int:
+        return getattr(self.local, "depth", 0)
+
+    def emit(self, name: str, start_ns: int, end_ns: int, attrs: Dict[str, Any], pid: int | None = None,
+             tid: int | None = None, depth: int = 0, max_rss_kb: int | None = None, rss_growth_kb: int | None = None) -> None:
+        pid = pid or os.getpid()
+        tid = tid or threading.get_ident()
+        with self.lock:
+            if self.collected is not None:
+                self.collected.append({
+                    "name": name, "start_ns": start_ns, "end_ns": end_ns, "attrs": attrs, "pid": pid, "tid": tid,
+                    "depth": depth, "max_rss_kb": max_rss_kb, "rss_growth_kb": rss_growth_kb
+                })
+            if self.jsonl is not None:
+                self.jsonl.write(json.dumps({
+                    "name": name,
+                    "start": start_ns / 1e9,
+                    "duration_ms": (end_ns - start_ns) / 1e6,
+                    "depth": depth,
+                    "pid": pid,
+                    "tid": tid,
+                    "max_rss_kb": max_rss_kb,
+                    "rss_growth_kb": rss_growth_kb,
+                    **attrs
+                }, default=str) + "\n")
+            if self.chrome_path is not None:
+                self.events.append({
+                    "name": name,
+                    "ph": "X",
+                    "ts": start_ns / 1e3,
+                    "dur": (end_ns - start_ns) / 1e3,
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"max_rss_kb": max_rss_kb, "rss_growth_kb": rss_growth_kb, **attrs}
+                })
+
+    def close(self) -> None:
+        if self.jsonl is not None:
+            self.jsonl.close()
+        if self.chrome_path is not None:
+            with open(self.chrome_path, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f, default=str)
+
+def enable(jsonl_path: str | None = None, chrome_path: str | None = None) -> None:
+    """
+    Starts tracing spans to a JSON lines file and/or a Chrome trace file
+    (viewable in chrome://tracing or Perfetto). Call finish() to flush them.
+    """
+    global _tracer
+    finish()
+    if jsonl_path or chrome_path:
+        _tracer = _Tracer(jsonl_path, chrome_path)
+
+def finish() -> None:
+    """
+    Stops tracing and writes out anything still buffered.
+    """
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+        _tracer = None
+
+def init_worker(enabled: bool) -> None:
+    """
+    Initializer of pool workers, given whether the parent is tracing. Drops the tracer a
+    forked worker inherited, and while the parent traces, keeps the worker's spans in memory
+    instead so they go back with each result (run_in_worker) and the parent writes them.
+    """
+    global _tracer
+    _tracer = _Tracer(None, None, collect=True) if enabled else None
+
+def run_in_worker(name: str, attrs: Dict[str, Any], func: Callable[..., Any], *args: Any) -> tuple[Any, List[Dict[str, Any]]]:
+    """
+    Runs func(*args) in a pool worker (see init_worker) as a span named name, and returns
+    its result with every span the worker recorded meanwhile, for replay() in the parent.
+    """
+    with span(name, **attrs):
+        result = func(*args)
+    tracer = _tracer
+    if tracer is None or tracer.collected is None:
+        return result, []
+    with tracer.lock:
+        spans, tracer.collected = tracer.collected, []
+    return result, spans
+
+def replay(spans: List[Dict[str, Any]]) -> None:
+    """
+    Records the spans a pool worker sent back (run_in_worker), with their own timing, memory
+    and process, nested under the span open here.
+    """
+    tracer = _tracer
+    if tracer is not None:
+        depth = tracer.depth()
+        for recorded in spans:
+            tracer.emit(**{**recorded, "depth": recorded["depth"] + depth})
+
+def is_enabled() -> bool:
+    return _tracer is not None
+
+@contextmanager
+def _span(tracer: _Tracer, name: str, attrs: Dict[str, Any]) -> Iterator[None]:
+    depth = tracer.depth()
+    tracer.local.depth = depth + 1
+    rss_before = _max_rss_kb()
+    start_ns = time.time_ns()
+    try:
+        yield
+    finally:
+        end_ns = time.time_ns()
+        tracer.local.depth = depth
+        rss_after = _max_rss_kb()
+        growth = rss_after - rss_before if rss_after is not None and rss_before is not None else None
+        tracer.emit(name, start_ns, end_ns, attrs, depth=depth, max_rss_kb=rss_after, rss_growth_kb=growth)
+
+def span(name: str, **attrs: Any) -> ContextManager[None]:
+    """
+    Times the enclosed block as a named span, with the process peak memory at its end
+    and how much that peak grew during the span. A no-op unless tracing is enabled.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return _span(tracer, name, attrs)
+
+def traced(name: str) -> Callable[[F], F]:
+    """
+    Decorator form of span() for a whole function.
+    """
+    def decorator(func: F) -> F:
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            tracer = _tracer
+            if tracer is None:
+                return func(*args, **kwargs)
+            with _span(tracer, name, {}):
+                return func(*args, **kwargs)
+        return wrapper  # type: ignore[return-value]
+    return decorator
@@ -1,3 +1,5 @@
+import os
+import hashlib
 from datetime import datetime
 
 def format_currency(amount: float, symbol: str = "$", places: int = 2) -> str:
@@ -12,6 +14,47 @@ def format_currency(amount: float, symbol: str = "$", places: int = 2) -> str:
     amount = abs(amount)
     return f"{sign}{symbol}{amount:,.{places}f}"
 
+def to_cents(amount: float) -> int:
+    """
+    Converts a dollar amount to whole cents, rounding away float noise.
+
+    Example:
+        to_cents(-20000.1) -> -2000010
+    """
+    return int(round(amount * 100))
+
+def format_table(headers: list[str], rows: list[list[str]]) -> str:
+    """
+    Formats rows of strings as a right aligned plain text table with a header line.
+
+    Example:
+        format_table(["Label", "Interest"], [["joe", "-$5.00"]]) ->
+            "Label Interest\n  joe   -$5.00"
+    """
+    widths = [max(len(cell) for cell in column) for column in zip(headers, *rows)]
+    lines = [" ".join(cell.rjust(width) for cell, width in zip(line, widths)) for line in [headers, *rows]]
+    return "\n".join(lines)
+
 def format_date(date_str: str) -> str:
     date = datetime.strptime(date_str, "%Y-%m-%d")
-    return date.strftime("%b %d, %Y")
\ No newline at end of file
+    return date.strftime("%b %d, %Y")
+
+def get_data_path(data_path: str | None = None) -> str:
+    """
+    Returns the folder results are written to (src/data unless given) and makes sure it exists.
+    """
+    if data_path is None:
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        data_path = os.path.join(root_dir, "data")
+    os.makedirs(data_path, exist_ok=True)
+    return data_path
+
+def hash_file(path: str) -> str:
+    """
+    Returns the SHA-256 hex digest of a file's contents, read in 1 MiB chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -1,21 +1,46 @@
 import lib.definitions as d
+import lib.utils as u
 import csv
 import re
+import sys
+import json
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import List
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Sequence
 import os
-import fitz  # PyMuPDF
 
+if TYPE_CHECKING:
+    import numpy as np
+    from lib.store import LedgerStore
 
-def parse_csv(file: str) -> d.Account:
-    rows: List[d.AccountRow] = []
 
+description_split_pattern = re.compile(r'\s{2,}')
+
+@lru_cache(maxsize=4096)
+def _parse_date(date_str: str) -> datetime:
+    # exports repeat the same handful of dates many times
+    return datetime.strptime(date_str, "%d-%b-%Y")
+
+@lru_cache(maxsize=4096)
+def _parse_description(raw_description: str) -> tuple[str, str]:
+    parts = description_split_pattern.split(raw_description)
+
+    transaction_type = parts[0] if parts else ""
+    description = " ".join(parts[1:]) if len(parts) > 1 else ""
+
+    return sys.intern(transaction_type), sys.intern(description)
+
+def _iter_records(file: str) -> Iterator[tuple[str, datetime, str, str, float, float]]:
+    """
+    Streams (account number, date, type, description, amount, balance) tuples from a
+    Vancity account export, in file order.
+    """
     with open(file, newline='', encoding='utf-8') as csvfile:
         reader = csv.reader(csvfile)
 
-        account_number = None
-        last_balance = None
-
         for i, row in enumerate(reader):
             if not row or len(row) < 7:
                 continue  # skip empty or malformed lines
@@ -27,21 +52,14 @@ def parse_csv(file: str) -> d.Account:
             amount_add = row[5].strip()
             balance_str = row[6].strip()
 
-            # Save the first seen account number
-            if account_number is None:
-                account_number = acc_num
-
             # Parse date
             try:
-                date = datetime.strptime(date_str, "%d-%b-%Y")
+                date = _parse_date(date_str)
             except ValueError:
                 raise ValueError(f"Invalid date format in row {i+1}: '{date_str}'")
             
             # Parse type and description
-            parts = re.split(r'\s{2,}', raw_description)
-
-            transaction_type = parts[0] if parts else ""
-            description = " ".join(parts[1:]) if len(parts) > 1 else ""
+            transaction_type, description = _parse_description(raw_description)
 
             # Determine actual amount (subtracted is negative, added is positive)
             amount = 0.0
@@ -52,28 +70,130 @@ def parse_csv(file: str) -> d.Account:
 
             # Parse balance
             balance = float(balance_str.replace(",", ""))
-            last_balance = balance
 
-            rows.append(d.AccountRow(
-                date=date,
-                type=transaction_type,
-                description=description,
-                amount=amount,
-                balance=balance
-            ))
+            yield acc_num, date, transaction_type, description, amount, balance
+
+def iter_csv(file: str) -> Iterator[d.AccountRow]:
+    """
+    Streams the rows of a Vancity account export one at a time, in file order.
+    """
+    for _, date, transaction_type, description, amount, balance in _iter_records(file):
+        yield d.AccountRow(
+            date=date,
+            type=transaction_type,
+            description=description,
+            amount=amount,
+            balance=balance
+        )
+
+def closing_row(dates: "Sequence[int] | np.ndarray") -> int:
+    """
+    Returns the row holding the current balance of an account sorted by date (see parse_csv):
+    the newest transaction, which exports list first on its day.
+    """
+    return bisect_left(dates, dates[-1])
+
+def parse_csv(file: str, store: "LedgerStore | None" = None) -> d.Account:
+    """
+    Parses a Vancity account export into an account sorted by date.
+
+    The current balance is the balance after the newest transaction (closing_row).
+
+    With a store, the new transactions of the export are added to it and the full stored
+    history of the account is returned instead; an export already imported unchanged is
+    not parsed again.
+
+    Raises:
+        ValueError if the store holds just the transactions of the export but closes at
+        another balance
+    """
+    if store is not None:
+        account_number = store.imported_account(file)
+        if account_number is not None:
+            return store.account(account_number)
+        account = parse_csv(file)
+        store.import_account(account, file)
+        history = store.account(account.label)
+        if len(history.rows) == len(account.rows) and history.currBalance != account.currBalance:
+            raise ValueError(
+                f"Stored history of account {account.label} closes at {history.currBalance}, the export at {account.currBalance}"
+            )
+        return history
+
+    rows = d.Ledger()
+
+    account_number = None
+    last_balance = None
+
+    for acc_num, date, transaction_type, description, amount, balance in _iter_records(file):
+        # Save the first seen account number
+        if account_number is None:
+            account_number = acc_num
+        last_balance = balance
+
+        rows.append(d.AccountRow(
+            date=date,
+            type=transaction_type,
+            description=description,
+            amount=amount,
+            balance=balance
+        ))
 
     if account_number is None or last_balance is None:
         raise ValueError("Failed to parse account number or balance from file.")
     
-    rows.sort(key=lambda r: r.date)
+    rows.sort()
 
     return d.Account(
         label=account_number,
         rows=rows,
-        currBalance=last_balance,
+        currBalance=rows.balance_cents[closing_row(rows.dates)] / 100,
         totalInterest=-1,
         totalPrinciple=-1
     )
+
+def parse_csv_columns(file: str) -> d.AccountColumns:
+    """
+    Parses a Vancity account export into columns instead of row objects.
+
+    Dates are day ordinals, amounts and balances are float arrays and the type and
+    description strings are interned. Rows are sorted by date and the current balance
+    picked like parse_csv.
+    """
+    import numpy as np
+
+    account_number = None
+    dates = array("q")
+    amounts = array("d")
+    balances = array("d")
+    types: List[str] = []
+    descriptions: List[str] = []
+
+    for acc_num, date, transaction_type, description, amount, balance in _iter_records(file):
+        if account_number is None:
+            account_number = acc_num
+        dates.append(date.toordinal())
+        types.append(transaction_type)
+        descriptions.append(description)
+        amounts.append(amount)
+        balances.append(balance)
+
+    if account_number is None or not balances:
+        raise ValueError("Failed to parse account number or balance from file.")
+
+    date_column = np.frombuffer(dates, dtype=np.int64)
+    order = np.argsort(date_column, kind="stable")
+    balance_column = np.frombuffer(balances, dtype=float)[order]
+
+    return d.AccountColumns(
+        label=account_number,
+        dates=date_column[order],
+        types=[types[k] for k in order],
+        descriptions=[descriptions[k] for k in order],
+        amounts=np.frombuffer(amounts, dtype=float)[order],
+        balances=balance_column,
+        currBalance=float(balance_column[closing_row(date_column[order])])
+    )
     
 metadata_pattern = re.compile(
         r'^ACCOUNTOWNERS:.*'
@@ -110,6 +230,8 @@ item_pattern = re.compile(
 )
     
 def _redact_statement(in_path: str, out_path: str, account: str) -> None:
+    import fitz  # PyMuPDF, imported here since it is slow to load and only needed for PDFs
+
     correct_header_pattern = re.compile(
         rf'.\s*#{account}.\s*', 
         re.IGNORECASE
@@ -155,18 +277,118 @@ def _redact_statement(in_path: str, out_path: str, account: str) -> None:
     doc.close()
     inside_section = False
 
-def redact_statements(input_folder: str, output_folder: str, account: str) -> None:
-    # Patterns
+REDACTION_MANIFEST = ".redaction-manifest.json"
+
+def _load_redaction_manifest(output_folder: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(output_folder, REDACTION_MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_redaction_manifest(output_folder: str, manifest: Dict[str, Any]) -> None:
+    path = os.path.join(output_folder, REDACTION_MANIFEST)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def _source_entry(in_path: str, account: str) -> Dict[str, Any]:
+    stat = os.stat(in_path)
+    return {"sha256": u.hash_file(in_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "account": account}
 
+def _is_redaction_current(in_path: str, out_path: str, account: str, entry: Dict[str, Any] | None) -> bool:
+    """
+    A redacted output is current when it exists and was produced from the same source
+    contents for the same account.
+
+    Like the rate cache, a source whose size and mtime match the manifest is not read.
+    If either changed, the content hash decides and a match refreshes them, so a copied
+    or touched statement is not redacted again.
+    """
+    if entry is None or entry.get("account") != account or not os.path.exists(out_path):
+        return False
+    stat = os.stat(in_path)
+    if entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+        return True
+    if entry.get("sha256") != u.hash_file(in_path):
+        return False
+    entry["size"] = stat.st_size
+    entry["mtime_ns"] = stat.st_mtime_ns
+    return True
+
+def redact_statements(input_folder: str, output_folder: str, account: str, workers: int = 1) -> d.RedactionSummary:
+    """
+    Redacts every statement PDF in input_folder into output_folder as <name>-redacted.pdf.
+
+    Statements whose redacted output is already up to date (according to the manifest of
+    source sizes, mtimes and hashes kept in the output folder) are skipped, the rest are
+    redacted across worker processes when workers > 1.
+
+    Args:
+        input_folder (str): Folder containing the statement PDFs
+        output_folder (str): Folder the redacted PDFs are written to
+        account (str): Account number whose transactions are kept
+        workers (int): Number of processes used to redact, 1 redacts in this process
+
+    Returns:
+        d.RedactionSummary: How many statements were processed, skipped and which failed
+    """
     os.makedirs(output_folder, exist_ok=True)
 
-    for fname in os.listdir(input_folder):
+    manifest = _load_redaction_manifest(output_folder)
+    pending: list[tuple[str, str, str, Dict[str, Any]]] = []
+    skipped = 0
+
+    for fname in sorted(os.listdir(input_folder)):
         if not fname.lower().endswith(".pdf"):
             continue
 
         in_path = os.path.join(input_folder, fname)
         out_path = os.path.join(output_folder, fname.replace(".pdf", "-redacted.pdf"))
-        
-        _redact_statement(in_path, out_path, account)
-        
-    print(f"Redacted {len(os.listdir(input_folder))} statements to {output_folder}")
\ No newline at end of file
+
+        if _is_redaction_current(in_path, out_path, account, manifest.get(fname)):
+            skipped += 1
+            continue
+
+        pending.append((fname, in_path, out_path, _source_entry(in_path, account)))
+
+    failed: list[str] = []
+
+    def record(fname: str, entry: Dict[str, Any], error: Exception | None) -> None:
+        if error is None:
+            manifest[fname] = entry
+        else:
+            manifest.pop(fname, None)
+            failed.append(f"{fname}: {error}")
+
+    if workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_redact_statement, in_path, out_path, account) for _, in_path, out_path, _ in pending]
+            for (fname, _, _, entry), future in zip(pending, futures):
+                try:
+                    future.result()
+                    record(fname, entry, None)
+                except Exception as e:
+                    record(fname, entry, e)
+    else:
+        for fname, in_path, out_path, entry in pending:
+            try:
+                _redact_statement(in_path, out_path, account)
+                record(fname, entry, None)
+            except Exception as e:
+                record(fname, entry, e)
+
+    _save_redaction_manifest(output_folder, manifest)
+
+    summary = d.RedactionSummary(
+        processed=len(pending) - len(failed),
+        skipped=skipped,
+        failed=failed
+    )
+
+    print(f"Redacted {summary.processed} statements to {output_folder}, {summary.skipped} up to date, {len(summary.failed)} failed")
+    for failure in summary.failed:
+        print(f"  {failure}")
+
+    return summary
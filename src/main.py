@@ -1,71 +1,462 @@
-import pandas as pd
+import argparse
+import csv
+import os
+import sys
+from datetime import date
+from contextlib import nullcontext
+from functools import partial
+from typing import TYPE_CHECKING, Callable, ContextManager
 
-import lib.rates as r
-import lib.vancity as v
-import lib.interest as i
-import lib.accounts as a
+import lib.definitions as d
+import lib.trace as trace
 import lib.utils as u
 
-import lib.definitions as d
+from config import Params, load_config
 
-from config import config
+# Heavy modules (numpy, PyMuPDF) are imported inside the commands that need them,
+# so quick commands like `validate` and `summary` start fast.
 
-def main():
-    # Redact statements for sharing
-    if config["REDACT_STATEMENTS"]:
-        v.redact_statements(
-            input_folder=config["STATEMENT_FOLDER"],
-            output_folder=f"{config["STATEMENT_FOLDER"]}/output",
-            account=config["VANCITY_ACCOUNT_NUMBER"]
-        )
-    
-    # Export parsed rates
+if TYPE_CHECKING:
+    from lib.balances import BalanceIndex
+    from lib.store import LedgerStore
+
+# Day of the month Vancity charges interest on
+INTEREST_DAY = 14
+
+def open_store(config: Params) -> "ContextManager[LedgerStore | None]":
+    """
+    Opens the SQLite store when STORE_PATH is set, otherwise yields None.
+    """
+    if not config.get("STORE_PATH"):
+        return nullcontext()
+    from lib.store import LedgerStore
+
+    return LedgerStore(config["STORE_PATH"])
+
+@trace.traced("redact")
+def redact(config: Params) -> None:
+    import lib.vancity as v
+
+    v.redact_statements(
+        input_folder=config["STATEMENT_FOLDER"],
+        output_folder=config.get("REDACT_FOLDER", os.path.join(config["STATEMENT_FOLDER"], "output")),
+        account=config["VANCITY_ACCOUNT_NUMBER"],
+        workers=config.get("REDACT_WORKERS", 1)
+    )
+
+@trace.traced("load_rates")
+def load_rates(config: Params, all_statements: bool = False) -> tuple[list[d.InterestSummary], list[d.InterestSummary]]:
+    """
+    Returns the raw and collapsed rates extracted from the statements. Only the statements
+    needed for the loans are opened, unless all_statements is set.
+    """
+    import lib.accounts as a
+    import lib.rates as r
+
+    if config.get("CLEAR_RATE_CACHE", False):
+        r.clear_rate_cache()
     statements = r.parse_statements(config["STATEMENT_FOLDER"])
-    rates = r.get_rates(statements=statements)    
-    r.export_csv("rates.csv", rates)
-    
-    # Export statement file
-    account = v.parse_csv(config["VANCITY_PATH"])
-    a.export_csv("account.csv", account)
-    
-    # Parse loan accounts from config
-    loanAccounts: list[d.Account] = []
-    for jsonAccount in config["LOANS"]:
-        # convert json data (dict) to account type
-        loanAccount = a.dict_to_account(jsonAccount)
-        loanAccounts.append(loanAccount)
-        
-    # Validate imported loan accounts
-    a.validate_transactions(account, loanAccounts)
-    
-    accounts: list[d.Account] = []
-    
+    with open_store(config) as store:
+        if all_statements:
+            raw_rates = r.get_raw_rates(
+                statements=statements,
+                use_cache=config.get("RATE_CACHE", True),
+                workers=config.get("RATE_WORKERS", 1),
+                store=store
+            )
+        else:
+            start, end = a.rate_window(config["LOANS"])
+            raw_rates = r.get_raw_rates_in_range(
+                statements, start, end,
+                use_cache=config.get("RATE_CACHE", True),
+                workers=config.get("RATE_WORKERS", 1),
+                store=store
+            )
+    return raw_rates, r.collapse_rates(raw_rates)
+
+@trace.traced("parse_csv")
+def load_account(config: Params) -> d.Account:
+    import lib.vancity as v
+
+    with open_store(config) as store:
+        return v.parse_csv(config["VANCITY_PATH"], store)
+
+@trace.traced("load_loans")
+def load_loans(config: Params) -> list[d.Account]:
+    import lib.accounts as a
+
+    # convert json data (dict) to account type
+    return [a.dict_to_account(jsonAccount) for jsonAccount in config["LOANS"]]
+
+@trace.traced("validate")
+def validate(account: d.Account, loanAccounts: list[d.Account]) -> d.ValidationReport:
+    import lib.accounts as a
+
+    report = a.validate_transactions(account, loanAccounts)
+    print(report)
+    return report
+
+@trace.traced("calculate_interest")
+def calculate_interest(config: Params, rates: list[d.InterestSummary], loanAccounts: list[d.Account]) -> list[d.Account]:
+    import lib.interest as i
+    from lib.schedule import RateSchedule
+
+    # Warn about days without a known rate, no interest accrues on them
+    schedule = RateSchedule(rates)
+    first_loan = min(row.date for loanAccount in loanAccounts for row in loanAccount.rows)
+    for start, end in schedule.gaps(first_loan, date.today()):
+        print(f"Warning: no interest rate found from {start} to {end}")
+
+    # resume every borrower from the checkpoints of the last run
+    if config.get("INCREMENTAL_INTEREST", False):
+        import lib.checkpoints as c
+
+        return c.calculate_interest_incremental(
+            loanAccounts, schedule,
+            os.path.join(u.get_data_path(config.get("OUTPUT_FOLDER")), "checkpoints"),
+            INTEREST_DAY,
+            exact=config.get("EXACT_INTEREST", False)
+        )
+
+    # calculate the interest for every borrower at once
+    return i.calculate_interest_batch(
+        loanAccounts, schedule, INTEREST_DAY,
+        exact=config.get("EXACT_INTEREST", False)
+    )
+
+@trace.traced("reconcile")
+def reconcile(account: d.Account, accounts: list[d.Account]) -> d.ReconciliationReport:
+    import lib.reconcile as rc
+
+    report = rc.reconcile_interest(account, accounts)
+    print(report)
+    return report
+
+@trace.traced("build_indexes")
+def build_indexes(config: Params, loanAccounts: list[d.Account]) -> list[tuple[str, "BalanceIndex"]]:
+    """
+    Returns the point in time index of every borrower, by label. Indexes are kept next to
+    the interest exports (index_<label>.npz) and reused while the borrower's rows, the
+    statements and the interest settings are unchanged and it is still the same day, so the
+    rates are only extracted and the interest computed for the borrowers that changed.
+    """
+    import lib.interest as i
+    import lib.rates as r
+    from lib.balances import BalanceIndex, index_key
+    from lib.schedule import RateSchedule
+
+    exact = config.get("EXACT_INTEREST", False)
+    data_path = u.get_data_path(config.get("OUTPUT_FOLDER"))
+    rates_fingerprint = r.fingerprint_statements(r.parse_statements(config["STATEMENT_FOLDER"]))
+    schedule = None
+    indexes = []
     for loanAccount in loanAccounts:
-        
-        # calculate the interest and create new account
-        interestAccount = i.calculate_interest_rows(loanAccount, rates, 14)
-        
-        accounts.append(interestAccount)
-        
-        # export to file
-        a.export_csv(f"interest_{interestAccount.label}.csv", interestAccount)
-        
+        full_path = os.path.join(data_path, f"index_{loanAccount.label}.npz")
+        key = index_key(loanAccount, rates_fingerprint, INTEREST_DAY, exact, date.today())
+        index = BalanceIndex.load(full_path, key)
+        if index is None:
+            if schedule is None:
+                schedule = RateSchedule(load_rates(config)[1])
+            _, index = i.calculate_interest_rows(loanAccount, schedule, INTEREST_DAY, exact=exact, with_index=True)
+            index.save(full_path, key)
+        indexes.append((loanAccount.label, index))
+    return indexes
+
+@trace.traced("export")
+def export(config: Params, account: d.Account | None, raw_rates: list[d.InterestSummary] | None,
+           rates: list[d.InterestSummary] | None, accounts: list[d.Account]) -> None:
+    import lib.export as e
+
+    e.export_ledgers(
+        account, raw_rates, rates, accounts,
+        format=config.get("EXPORT_FORMAT", "csv"),
+        data_path=config.get("OUTPUT_FOLDER")
+    )
+
+def print_summary(summary: list[tuple[str, float, float, float]]) -> None:
+    """
+    Prints (label, principle, interest, balance) per borrower with the totals.
+    """
+    rows = [
+        [label, u.format_currency(principle), u.format_currency(interest), u.format_currency(balance)]
+        for label, principle, interest, balance in summary
+    ]
+    print(u.format_table(["Label", "Principle", "Interest", "Balance Remaining"], rows))
+    print(f"Total Balance is {u.format_currency(sum(s[3] for s in summary))}")
+    print(f"Total Interest is {u.format_currency(sum(s[2] for s in summary))}")
+
+def summarize_accounts(accounts: list[d.Account]) -> list[tuple[str, float, float, float]]:
+    return [(acc.label, acc.totalPrinciple, acc.totalInterest, acc.currBalance) for acc in accounts]
+
+def summarize_exports(config: Params) -> list[tuple[str, float, float, float]]:
+    """
+    Reads the summary of the last run back from its exports without recomputing anything:
+    the totals it wrote to summary.json, or for a borrower missing there, the totals of its
+    interest_<label> file summed in cents.
+    """
+    import lib.export as e
+
+    data_path = u.get_data_path(config.get("OUTPUT_FOLDER"))
+    format = config.get("EXPORT_FORMAT", "csv")
+    totals = e.load_summary(os.path.join(data_path, e.SUMMARY_FILE))
+    summary: list[tuple[str, float, float, float]] = []
+
+    for loan in config["LOANS"]:
+        if loan["label"] in totals:
+            summary.append((loan["label"], *totals[loan["label"]]))
+            continue
+
+        full_path = os.path.join(data_path, f"interest_{loan['label']}.{format}")
+        principle = interest = balance = 0
+        if format == "npz":
+            columns = e.load_columns(full_path)
+            is_interest = columns["type"] == "interest"
+            interest = int(columns["amount_cents"][is_interest].sum())
+            principle = int(columns["amount_cents"][~is_interest].sum())
+            balance = int(columns["balance_cents"][-1]) if len(columns["balance_cents"]) else 0
+        else:
+            with open(full_path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    amount = u.to_cents(float(row["amount"]))
+                    if row["type"] == "interest":
+                        interest += amount
+                    else:
+                        principle += amount
+                    balance = u.to_cents(float(row["balance"]))
+        summary.append((loan["label"], principle / 100, interest / 100, balance / 100))
+
+    return summary
+
+def check_transactions(account: d.Account, loanAccounts: list[d.Account]) -> None:
+    if not validate(account, loanAccounts).ok:
+        raise ValueError("loan transactions do not match the account history")
+
+def pipeline(config: Params, loaded_rates: tuple[list[d.InterestSummary], list[d.InterestSummary]] | None = None) -> list[d.Stage]:
+    """
+    Returns the stages of a full run. Redaction, rate extraction and parsing the account
+    history are independent, interest waits for the validated loans and the rates, and the
+    statement exports do not wait for the interest. Validation waits for the statement
+    exports, so they are written even when it fails.
+    """
+    stages: list[d.Stage] = []
+
+    # Redact statements for sharing
+    if config["REDACT_STATEMENTS"]:
+        stages.append(d.Stage("redact", partial(redact, config), process=True))
+
+    if loaded_rates is None:
+        stages.append(d.Stage("rates", partial(load_rates, config), process=True))
+    else:
+        stages.append(d.Stage("rates", lambda: loaded_rates))
+
+    stages += [
+        d.Stage("account", partial(load_account, config)),
+        d.Stage("loans", partial(load_loans, config)),
+        d.Stage("export_statements", lambda account, rates: export(config, account, rates[0], rates[1], []), ["account", "rates"]),
+        # Validate imported loan accounts, once the rates and history are exported so a
+        # failed validation still leaves them to look into
+        d.Stage("validate", lambda account, loanAccounts, _: check_transactions(account, loanAccounts), ["account", "loans", "export_statements"]),
+        d.Stage("interest", lambda rates, loanAccounts, _: calculate_interest(config, rates[1], loanAccounts), ["rates", "loans", "validate"]),
+        # Check the interest against what the bank charged
+        d.Stage("reconcile", reconcile, ["account", "interest"]),
+        d.Stage("export_interest", lambda accounts: export(config, None, None, None, accounts), ["interest"]),
+    ]
+    return stages
+
+def run(config: Params, loaded_rates: tuple[list[d.InterestSummary], list[d.InterestSummary]] | None = None) -> list[d.Account]:
+    """
+    Runs the full pipeline and returns the interest account of every borrower.
+
+    Set STAGE_WORKERS above 1 to run independent stages at once, see lib.pipeline.
+
+    Args:
+        config (Params): The params of the Vancity account
+        loaded_rates (tuple | None): Raw and collapsed rates when already extracted, e.g. by a batch run
+    """
+    import lib.pipeline as p
+
+    results = p.run_stages(pipeline(config, loaded_rates), config.get("STAGE_WORKERS", 1))
+    return results["interest"]
+
+def cmd_run(config: Params, args: argparse.Namespace) -> int:
+    accounts = run(config)
+
     # Visualize data in console
-    df = pd.DataFrame(accounts)
-    df["Principle"] = df["totalPrinciple"].apply(u.format_currency)
-    df["Interest"] = df["totalInterest"].apply(u.format_currency)
-    df["Balance Remaining"] = df["currBalance"].apply(u.format_currency)
-    df = df.rename(columns={"label": "Label"})
-    
-    total_balance = df["currBalance"].sum()
-    total_interest = df["totalInterest"].sum()
-    
-    df = df.drop(columns=["rows", "currBalance", "totalInterest", "totalPrinciple"]) # drop for visualization
-    
-    print(df)
-    print(f"Total Balance is {u.format_currency(total_balance)}")
-    print(f"Total Interest is {u.format_currency(total_interest)}")
-    
+    print_summary(summarize_accounts(accounts))
+    return 0
+
+def cmd_rates(config: Params, args: argparse.Namespace) -> int:
+    raw_rates, rates = load_rates(config, all_statements=True)
+    export(config, None, raw_rates, rates, [])
+    return 0
+
+def cmd_parse(config: Params, args: argparse.Namespace) -> int:
+    export(config, load_account(config), None, None, [])
+    return 0
+
+def cmd_validate(config: Params, args: argparse.Namespace) -> int:
+    report = validate(load_account(config), load_loans(config))
+    return 0 if report.ok else 1
+
+def cmd_interest(config: Params, args: argparse.Namespace) -> int:
+    _, rates = load_rates(config)
+    loanAccounts = load_loans(config)
+    if not validate(load_account(config), loanAccounts).ok:
+        return 1
+    accounts = calculate_interest(config, rates, loanAccounts)
+    export(config, None, None, None, accounts)
+    print_summary(summarize_accounts(accounts))
+    return 0
+
+def cmd_reconcile(config: Params, args: argparse.Namespace) -> int:
+    _, rates = load_rates(config)
+    account = load_account(config)
+    loanAccounts = load_loans(config)
+    if not validate(account, loanAccounts).ok:
+        return 1
+    report = reconcile(account, calculate_interest(config, rates, loanAccounts))
+    return 0 if report.ok else 1
+
+def cmd_allocate(config: Params, args: argparse.Namespace) -> int:
+    import lib.allocation as al
+    import lib.export as e
+
+    _, rates = load_rates(config)
+    account = load_account(config)
+    loanAccounts = load_loans(config)
+    if not validate(account, loanAccounts).ok:
+        return 1
+    computed = calculate_interest(config, rates, loanAccounts)
+    allocation = al.allocate_bank_interest(account, loanAccounts)
+    allocated = al.allocation_ledgers(loanAccounts, allocation)
+
+    # write the allocated ledgers next to the computed ones
+    data_path = u.get_data_path(config.get("OUTPUT_FOLDER"))
+    format = config.get("EXPORT_FORMAT", "csv")
+    for allocatedAccount in allocated:
+        e.write_account(os.path.join(data_path, f"allocated_{allocatedAccount.label}.{format}"), allocatedAccount, format)
+
+    rows = [
+        [ours.label, u.format_currency(ours.totalInterest), u.format_currency(theirs.totalInterest),
+         u.format_currency(theirs.totalInterest - ours.totalInterest)]
+        for ours, theirs in zip(computed, allocated)
+    ]
+    print(u.format_table(["Label", "Computed Interest", "Allocated Interest", "Difference"], rows))
+    print(f"Bank charged {u.format_currency(allocation.charges.sum() / 100)} in {len(allocation.charges)} charges")
+    if allocation.unallocated.any():
+        print(f"{u.format_currency(allocation.unallocated.sum() / 100)} was charged while no borrower owed anything")
+    return 0
+
+def cmd_redact(config: Params, args: argparse.Namespace) -> int:
+    redact(config)
+    return 0
+
+def cmd_summary(config: Params, args: argparse.Namespace) -> int:
+    print_summary(summarize_exports(config))
+    return 0
+
+def select_loans(config: Params, labels: list[str]) -> list[d.Account] | None:
+    """
+    Returns the loans of the given borrowers (all of them without labels), or None
+    after reporting any label that is not a borrower.
+    """
+    loanAccounts = load_loans(config)
+    if labels:
+        unknown = set(labels) - {loanAccount.label for loanAccount in loanAccounts}
+        if unknown:
+            print(f"Unknown borrower {', '.join(sorted(unknown))}")
+            return None
+        loanAccounts = [loanAccount for loanAccount in loanAccounts if loanAccount.label in labels]
+    return loanAccounts
+
+def cmd_query(config: Params, args: argparse.Namespace) -> int:
+    loanAccounts = select_loans(config, args.labels)
+    if loanAccounts is None:
+        return 1
+
+    indexes = build_indexes(config, loanAccounts)
+
+    if args.date or not args.between:
+        rows = [
+            [label, str(day), u.format_currency(index.balance_at(day)),
+             u.format_currency(index.accrued_at(day)), u.format_currency(index.owed_at(day))]
+            for day in args.date or [date.today()]
+            for label, index in indexes
+        ]
+        print(u.format_table(["Label", "Date", "Balance", "Accrued Interest", "Owed"], rows))
+
+    if args.between:
+        rows = [
+            [label, str(start), str(end), u.format_currency(index.interest_between(start, end)),
+             u.format_currency(index.interest_between(start, end, include_accrued=True))]
+            for start, end in args.between
+            for label, index in indexes
+        ]
+        print(u.format_table(["Label", "From", "To", "Interest Charged", "Interest Accrued"], rows))
+
+    return 0
+
+def cmd_daily(config: Params, args: argparse.Namespace) -> int:
+    import lib.export as e
+    import lib.interest as i
+
+    loanAccounts = select_loans(config, args.labels)
+    if loanAccounts is None:
+        return 1
+
+    _, rates = load_rates(config)
+    data_path = u.get_data_path(config.get("OUTPUT_FOLDER"))
+    for loanAccount in loanAccounts:
+        # every day is written as soon as it is computed
+        days = i.iter_daily_interest(loanAccount, rates, INTEREST_DAY, exact=config.get("EXACT_INTEREST", False))
+        full_path = os.path.join(data_path, f"daily_{loanAccount.label}.csv")
+        print(f"Exported {e.write_daily_ledger(full_path, days)} days to {full_path}")
+    return 0
+
+COMMANDS: dict[str, tuple[Callable[[Params, argparse.Namespace], int], str]] = {
+    "run": (cmd_run, "run the full pipeline (default)"),
+    "rates": (cmd_rates, "extract and export interest rates from the statements"),
+    "parse": (cmd_parse, "parse and export the account history csv"),
+    "validate": (cmd_validate, "check the loan rows against the account history"),
+    "interest": (cmd_interest, "calculate and export the interest ledger of every borrower"),
+    "reconcile": (cmd_reconcile, "compare the computed interest with the interest the bank charged"),
+    "allocate": (cmd_allocate, "split the interest the bank charged across borrowers and compare it with the computed interest"),
+    "redact": (cmd_redact, "redact the statements for sharing"),
+    "summary": (cmd_summary, "print the per borrower summary of the last run"),
+    "query": (cmd_query, "balance, interest and amount owed of borrowers on given dates"),
+    "daily": (cmd_daily, "export the day by day interest ledger of borrowers"),
+}
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Allocate Vancity loan interest across borrowers.")
+    parser.add_argument("--params", help="path to params.json (default: params.json in the project root)")
+    parser.add_argument("--trace", metavar="FILE", help="write timing and peak memory of every stage as JSON lines")
+    parser.add_argument("--chrome-trace", metavar="FILE", help="write the same spans as a Chrome trace (chrome://tracing, Perfetto)")
+    subparsers = parser.add_subparsers(dest="command")
+    for name, (_, help) in COMMANDS.items():
+        subparsers.add_parser(name, help=help)
+
+    query = subparsers.choices["query"]
+    query.add_argument("labels", nargs="*", metavar="label", help="borrowers to query (default: all)")
+    query.add_argument("--date", type=date.fromisoformat, action="append", metavar="YYYY-MM-DD",
+                       help="report balance, accrued interest and amount owed at the end of this day, repeatable (default: today)")
+    query.add_argument("--between", type=date.fromisoformat, nargs=2, action="append", metavar=("START", "END"),
+                       help="report the interest charged and accrued from START through END, repeatable")
+
+    daily = subparsers.choices["daily"]
+    daily.add_argument("labels", nargs="*", metavar="label", help="borrowers to export (default: all)")
+
+    args = parser.parse_args(argv)
+    config = load_config(args.params)
+    name = args.command or "run"
+    command, _ = COMMANDS[name]
+
+    trace.enable(args.trace, args.chrome_trace)
+    try:
+        with trace.span(name):
+            return command(config, args)
+    finally:
+        trace.finish()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())